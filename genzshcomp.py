@@ -1,27 +1,55 @@
 #!/usr/bin/env python
 """automatic generated to zsh completion function file"""
+import contextlib
+import errno
+import hashlib
+import json
+import math
+import os
 import re
 import sys
-from optparse import OptionParser
+import tempfile
+import time
+from optparse import OptionParser, SUPPRESS_HELP
 import subprocess
 
 try:
     import argparse
-    from argparse import ArgumentParser, RawDescriptionHelpFormatter
+    from argparse import ArgumentParser, RawDescriptionHelpFormatter, SUPPRESS
 except ImportError:
     argparse = None
+    SUPPRESS = SUPPRESS_HELP
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 __version__ = '0.5.2'
 __author__ = 'Hideo Hattroi <hhatto.jp@gmail.com>'
 __license__ = 'NewBSDLicense'
 
-__all__ = ["main", "CompletionGenerator", "HelpParser"]
+__all__ = ["main", "CompletionGenerator", "HelpParser", "SourceParser",
+           "get_completion", "get_cmdclass", "install", "load_json"]
 
 USAGE_DOCS = """\
-usage: genzshcomp FILE
+usage: genzshcomp -t FILE
+             or
+       genzshcomp -s SCRIPT.py
+             or
+       USER_SCRIPT --help | genzshcomp
+             or
+       genzshcomp -o DIR [--dedup] [--bundle FILE [--lazy]]
+                  [--cache-dir DIR] [--report FILE] COMMAND [COMMAND ...]
+             or
+       genzshcomp -f bash --install COMMAND [COMMAND ...]
              or
-       USER_SCRIPT --help | genzshcomp"""
+       genzshcomp --db FILE COMMAND [COMMAND ...]
+       genzshcomp query --db FILE COMMAND [PREFIX]
+             or
+       genzshcomp watch -o DIR [COMMAND ...]
+             or
+       genzshcomp stats [LOG]"""
 
 
 class InvalidParserTypeError(Exception):
@@ -41,6 +69,15 @@ def get_parser_type(parser_obj):
     return parser_type
 
 
+def _zsh_quote(strings):
+    """quote strings by singlequote for zsh.
+
+    >>> print(_zsh_quote("--opt:it's"))
+    '--opt:it'\\''s'
+    """
+    return "'%s'" % strings.replace("'", "'\\''")
+
+
 def _escape_strings(strings):
     """escape to squarebracket and doublequote.
 
@@ -64,18 +101,341 @@ def _escape_strings(strings):
     return "".join(ret)
 
 
+def get_option_table(parser_obj, parser_type=None):
+    """return to list of option entries, in order of parser's actions.
+
+    each entry is a dict: 'options' (option strings), 'metavar',
+    'choices', 'help', 'action', 'takes_value' and 'type' (name of
+    value type).
+    """
+    if not parser_type:
+        parser_type = get_parser_type(parser_obj)
+    if parser_type == 'optparse':
+        actions = parser_obj.option_list
+    else:
+        actions = parser_obj._actions
+        action_names = dict((cls, name) for name, cls in
+                            parser_obj._registries['action'].items()
+                            if name is not None)
+    table = []
+    for action in actions:
+        if parser_type == 'optparse':
+            opts = [i for i in action._long_opts]
+            opts += [i for i in action._short_opts]
+        else:
+            opts = list(action.option_strings)
+        if not opts or action.help in (SUPPRESS_HELP, SUPPRESS):
+            continue
+        metavar = action.metavar
+        if isinstance(metavar, tuple):
+            metavar = " ".join(metavar)
+        choices = None
+        if action.choices:
+            choices = [str(i) for i in action.choices]
+        if parser_type == 'optparse':
+            action_name = action.action
+            takes_value = action.takes_value()
+            type_name = action.type
+        else:
+            action_name = action_names.get(type(action),
+                                           type(action).__name__)
+            takes_value = action.nargs != 0
+            if isinstance(action.type, argparse.FileType):
+                type_name = 'file'
+            else:
+                type_name = getattr(action.type, '__name__', None)
+        table.append({'options': opts,
+                      'metavar': metavar,
+                      'choices': choices,
+                      'help': action.help,
+                      'action': action_name,
+                      'takes_value': takes_value,
+                      'type': type_name})
+    return table
+
+
+def get_table_fingerprint(table, parser_type):
+    """return to sha1 hex string of option table and genzshcomp version,
+    whose rendering may differ."""
+    data = json.dumps([__version__, parser_type, table], sort_keys=True,
+                      default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+# seconds to wait for other process regenerating the same cache
+CACHE_LOCK_TIMEOUT = 5.0
+
+
+def _open_lock(lockpath):
+    """return to file object of lockpath, or None."""
+    try:
+        return open(lockpath, 'a')
+    except (IOError, OSError):
+        return None
+
+
+def _is_same_file(fobj, lockpath):
+    """return True when fobj is still the file at lockpath, which is
+    removed by the previous holder of lock."""
+    try:
+        return os.path.samestat(os.fstat(fobj.fileno()), os.stat(lockpath))
+    except OSError:
+        return False
+
+
+@contextlib.contextmanager
+def cache_lock(path, timeout=None):
+    """lock ``path + '.lock'`` with flock(2) while in the block.
+
+    yields True when the lock is taken, False when it is not taken in
+    ``timeout`` seconds (default: CACHE_LOCK_TIMEOUT, or locking is not
+    available). the lock file is removed by its holder at the end of the
+    block, and a waiter which locked the removed file retries with a new
+    one.
+    """
+    if timeout is None:
+        timeout = CACHE_LOCK_TIMEOUT
+    lockpath = path + '.lock'
+    fobj = None
+    locked = False
+    if fcntl is not None:
+        fobj = _open_lock(lockpath)
+    deadline = time.time() + timeout
+    while fobj is not None:
+        try:
+            fcntl.flock(fobj.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            if time.time() >= deadline:
+                break
+            time.sleep(0.05)
+            continue
+        if _is_same_file(fobj, lockpath):
+            locked = True
+            break
+        fobj.close()
+        fobj = _open_lock(lockpath)
+    try:
+        yield locked
+    finally:
+        if fobj is not None:
+            if locked:
+                try:
+                    os.remove(lockpath)
+                except OSError:
+                    pass
+                fcntl.flock(fobj.fileno(), fcntl.LOCK_UN)
+            fobj.close()
+
+
+def write_atomic(path, content):
+    """write content to temporary file and rename it to path.
+
+    readers see old or new content, never partially written file.
+    """
+    dirname, basename = os.path.split(os.path.abspath(path))
+    fd, tmppath = tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+    try:
+        with os.fdopen(fd, 'w') as fobj:
+            fobj.write(content)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmppath, 0o666 & ~umask)
+        os.rename(tmppath, path)
+    except BaseException:
+        os.remove(tmppath)
+        raise
+
+
+def _read_cache(cache_file, fingerprint):
+    """return to cached output, or None when it is not for fingerprint."""
+    try:
+        with open(cache_file) as fobj:
+            if fobj.readline().rstrip("\n") == fingerprint:
+                return fobj.read()
+    except (IOError, OSError):
+        pass
+    return None
+
+
+_completion_cache = {}
+
+
+def get_completion(commandname, parser, output_format=None, cache_dir=None):
+    """return to completion function string, memoized by parser fingerprint.
+
+    rendered strings are kept in memory for each (command, format). when
+    ``cache_dir`` is given, they are also stored in
+    ``<cache_dir>/<commandname>.<format>.cache`` and reused by later
+    processes while the parser's options, help, metavars and choices are
+    unchanged.
+    """
+    compobj = CompletionGenerator(commandname, parser,
+                                  output_format=output_format)
+    fingerprint = compobj.fingerprint()
+    key = (commandname, compobj.output_format)
+    cached = _completion_cache.get(key)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+    if not cache_dir:
+        output = compobj.get()
+    else:
+        cache_file = os.path.join(cache_dir, "%s.%s.cache" %
+                                  (commandname, compobj.output_format))
+        output = _read_cache(cache_file, fingerprint)
+        if output is None:
+            if not os.path.isdir(cache_dir):
+                try:
+                    os.makedirs(cache_dir)
+                except OSError:
+                    pass
+            # one process renders and writes, others wait for it
+            with cache_lock(cache_file) as locked:
+                output = _read_cache(cache_file, fingerprint)
+                if output is None:
+                    output = compobj.get()
+                    if locked:
+                        try:
+                            write_atomic(cache_file,
+                                         fingerprint + "\n" + output)
+                        except (IOError, OSError):
+                            pass
+    _completion_cache[key] = (fingerprint, output)
+    return output
+
+
+METAVAR_KINDS = {
+    'FILE': 'file', 'FILENAME': 'file', 'PATH': 'file',
+    'DIR': 'dir', 'DIRECTORY': 'dir', 'FOLDER': 'dir',
+    'N': 'number', 'NUM': 'number', 'NUMBER': 'number', 'INT': 'number',
+    'INTEGER': 'number', 'FLOAT': 'number', 'COUNT': 'number',
+    'PORT': 'number', 'SECONDS': 'number', 'TIMEOUT': 'number',
+    'HOST': 'host', 'HOSTNAME': 'host',
+    'URL': 'url', 'URI': 'url',
+    'USER': 'user', 'USERNAME': 'user',
+}
+NUMBER_TYPES = ('int', 'long', 'float', 'complex')
+ZSH_VALUE_COMPLETERS = {
+    'file': '_files',
+    'dir': '_directories',
+    'number': ' ',
+    'host': '_hosts',
+    'url': '_urls',
+    'user': '_users',
+    'none': ' ',
+}
+
+BASH_VALUE_COMPLETERS = {
+    'file': 'compgen -f',
+    'dir': 'compgen -d',
+    'number': None,
+    'host': 'compgen -A hostname',
+    'url': None,
+    'user': 'compgen -u',
+    'none': None,
+}
+
+
+def get_user_value_kind(entry, completers):
+    """return to kind of option value in ``completers``, or None.
+
+    a user completer takes precedence over choices and ``{a,b}`` metavar
+    of the option, too.
+    """
+    if completers:
+        for key in entry['options'] + [entry['metavar']]:
+            if key in completers:
+                return completers[key]
+    return None
+
+
+def get_value_kind(entry, completers=None):
+    """return to kind of option value ('file', 'dir', 'number', ...).
+
+    :param entry: entry of option table
+    :param completers: user mapping of option string or metavar to kind
+    :return: kind name, or user defined value of ``completers``
+    """
+    kind = get_user_value_kind(entry, completers)
+    if kind is not None:
+        return kind
+    if entry['type'] in NUMBER_TYPES:
+        return 'number'
+    if entry['type'] == 'file':
+        return 'file'
+    metavar = (entry['metavar'] or '').strip('[]<>').upper()
+    if metavar in METAVAR_KINDS:
+        return METAVAR_KINDS[metavar]
+    # e.g. OUTPUT_FILE, LOG-DIR
+    suffix = re.split('[_-]', metavar)[-1]
+    return METAVAR_KINDS.get(suffix, 'file')
+
+
+def _get_value_name(entry):
+    """return to display name of option value."""
+    if entry['metavar']:
+        return entry['metavar']
+    return entry['options'][-1].lstrip('-').upper().replace('-', '_')
+
+
+JSON_FORMAT_VERSION = 1
+_JSON_ENTRY_DEFAULTS = {'metavar': None, 'choices': None, 'help': None,
+                        'action': 'store', 'takes_value': False,
+                        'type': None}
+
+
+def load_json(data, output_format=None, completers=None):
+    """return to CompletionGenerator of option table in JSON format.
+
+    parser object is not constructed. ``data`` is string or dict of the
+    output of ``-f json``::
+
+        {"version": 1, "command": "NAME", "parser_type": "argparse",
+         "options": [{"options": ["-f", "--file"], "short": ["-f"],
+                      "long": ["--file"], "metavar": "FILE",
+                      "choices": null, "help": "input file",
+                      "action": "store", "takes_value": true,
+                      "type": null}, ...]}
+
+    only "options" is required for each entry.
+    """
+    if not isinstance(data, dict):
+        data = json.loads(data)
+    if data.get('version') != JSON_FORMAT_VERSION:
+        raise ValueError("unsupported JSON format version: %r" %
+                         data.get('version'))
+    table = []
+    for entry in data['options']:
+        entry = dict(entry)
+        for key, value in _JSON_ENTRY_DEFAULTS.items():
+            entry.setdefault(key, value)
+        table.append(entry)
+    return CompletionGenerator(data.get('command'), None,
+                               data.get('parser_type', 'argparse'),
+                               output_format=output_format,
+                               completers=completers, option_table=table)
+
+
+# log file of --telemetry, expanded by shell at completion time
+TELEMETRY_LOG = ("${GENZSHCOMP_TELEMETRY_LOG:-${XDG_STATE_HOME:-$HOME/.local"
+                 "/state}/genzshcomp/latency.log}")
+
+
 class CompletionGenerator(object):
 
     """Generator of (Z|Ba)sh Completion Function"""
 
     def __init__(self, commandname=None, parser=None, parser_type=None,
-                 output_format=None):
+                 output_format=None, completers=None, option_table=None,
+                 telemetry=False):
         self.commandname = commandname
         self.parser = parser
         if not parser_type:
             parser_type = get_parser_type(parser)
         self.parser_type = parser_type
         self.output_format = output_format if output_format else 'zsh'
+        self.completers = completers
+        self._option_table = option_table
+        self.telemetry = telemetry
 
     def _get_dircomp(self, opt):
         """judged to directories and files completion.
@@ -94,7 +454,8 @@ class CompletionGenerator(object):
         if '-h' == opt or '--help' == opt:
             return ":"
         # user define options
-        if self.parser_type == 'optparse':  # TODO: now, only optparse module
+        if self.parser_type == 'optparse' and self.parser is not None:
+            # TODO: now, only optparse module
             opt_obj = self.parser._short_opt.get(opt)
             if opt_obj and opt_obj.action in ('store_true', 'store_false'):
                 return ""
@@ -104,27 +465,97 @@ class CompletionGenerator(object):
                     return ""
         return ""
 
+    @property
+    def option_table(self):
+        """option table of parser object (see :func:`get_option_table`)."""
+        if self._option_table is None:
+            self._option_table = get_option_table(self.parser,
+                                                  self.parser_type)
+        return self._option_table
+
+    def fingerprint(self):
+        """return to hash string of option table."""
+        return get_table_fingerprint(self.option_table, self.parser_type)
+
+    def _get_zsh_completer(self, entry):
+        """return to zsh action for option value."""
+        kind = get_value_kind(entry, self.completers)
+        return ZSH_VALUE_COMPLETERS.get(kind, kind)
+
     def _get_list_format(self):
         """return to string of list format."""
-        if self.parser_type == 'optparse':
-            actions = self.parser.option_list
-        elif self.parser_type == 'argparse':
-            actions = self.parser._actions
         ret = []
-        for action in actions:
-            if self.parser_type == 'optparse':
-                opts = [i for i in action._long_opts]
-                opts += [i for i in action._short_opts]
-            elif self.parser_type == 'argparse':
-                opts = action.option_strings
-            for opt in opts:
-                if action.help:
-                    tmp = "%s:%s" % (opt, _escape_strings(action.help))
+        for entry in self.option_table:
+            for opt in entry['options']:
+                if entry['help']:
+                    tmp = "%s:%s" % (opt, _escape_strings(entry['help']))
                 else:
                     tmp = "%s" % (opt)
                 ret.append(tmp)
         return "\n".join(ret)
 
+    def _get_json_format(self):
+        """return to string of JSON format (see :func:`load_json`)."""
+        options = []
+        for entry in self.option_table:
+            entry = dict(entry)
+            entry['short'] = [i for i in entry['options']
+                              if not i.startswith('--')]
+            entry['long'] = [i for i in entry['options']
+                             if i.startswith('--')]
+            options.append(entry)
+        return json.dumps({'version': JSON_FORMAT_VERSION,
+                           'generator': 'genzshcomp %s' % __version__,
+                           'command': self.commandname,
+                           'parser_type': self.parser_type,
+                           'options': options}, indent=1, sort_keys=True)
+
+    def _get_bash_completer(self, entry):
+        """return to bash command for value of option, or None."""
+        metavar = entry['metavar']
+        choices = entry['choices']
+        if get_user_value_kind(entry, self.completers) is not None:
+            choices = None
+        elif not choices and self.parser_type == 'argparse' and metavar and \
+                metavar[0] == '{' and metavar[-1] == '}':
+            choices = metavar[1:-1].split(',')
+        if choices:
+            words = " ".join(choices).replace('"', '\\"')
+            return 'COMPREPLY=( $( compgen -W "%s" -- $cur ) )' % words
+        kind = get_value_kind(entry, self.completers)
+        if kind in BASH_VALUE_COMPLETERS:
+            compgen = BASH_VALUE_COMPLETERS[kind]
+        else:
+            compgen = BASH_VALUE_COMPLETERS['file']
+        if compgen is None:
+            # no completion, and no fallback to filenames of '-o default'
+            return "compopt +o default 2>/dev/null"
+        return "COMPREPLY=( $( %s -- $cur ) )" % compgen
+
+    def _get_bash_prev_table(self):
+        """return to lines of 'case $prev' table for option values."""
+        table = {}
+        order = []
+        for entry in self.option_table:
+            if not (entry['takes_value'] or entry['metavar']):
+                continue
+            completer = self._get_bash_completer(entry)
+            if completer not in table:
+                table[completer] = []
+                order.append(completer)
+            table[completer] += entry['options']
+        if not order:
+            return []
+        ret = ["  case \"$prev\" in"]
+        for completer in order:
+            ret.append("    %s)" % "|".join('"%s"' % i
+                                             for i in table[completer]))
+            ret.append("      %s" % completer)
+            ret.append("      return 0")
+            ret.append("      ;;")
+        ret.append("  esac\n")
+        return ret
+
     def _get_bash_format(self):
         """return to string of bash completion function format."""
         ret = []
@@ -134,71 +565,228 @@ class CompletionGenerator(object):
         ret.append("# generated by genzshcomp(ver: %s)\n#\n" % __version__)
         ret.append("_%s()\n{" % self.commandname)
         ret.append(
-            "  local cur\n  local cmd\n\n  cur=${COMP_WORDS[$COMP_CWORD]}")
+            "  local cur\n  local prev\n  local cmd\n\n"
+            "  cur=${COMP_WORDS[$COMP_CWORD]}")
+        ret.append("  prev=${COMP_WORDS[$COMP_CWORD-1]}")
         ret.append("  cmd=( ${COMP_WORDS[@]} )\n")
-        if self.parser_type == 'optparse':
-            actions = self.parser.option_list
-        elif self.parser_type == 'argparse':
-            actions = self.parser._actions
+        ret += self._get_bash_prev_table()
         opts = []
-        for action in actions:
-            if self.parser_type == 'optparse':
-                opts += [i for i in action._long_opts]
-                opts += [i for i in action._short_opts]
-            elif self.parser_type == 'argparse':
-                opts += action.option_strings
+        for entry in self.option_table:
+            opts += entry['options']
         ret.append("  if [[ \"$cur\" == -* ]]; then")
         ret.append(
             "    COMPREPLY=( $( compgen -W \"%s\" -- $cur ) )" % " ".join(opts))
         ret.append("    return 0")
         ret.append("  fi")
         ret.append("}\n")
-        ret.append("complete -F _%s -o default %s" %
-                   (self.commandname, self.commandname))
+        funcname = "_%s" % self.commandname
+        if self.telemetry:
+            ret += self._get_bash_telemetry(funcname)
+            funcname += "_timed"
+        ret.append("complete -F %s -o default %s" %
+                   (funcname, self.commandname))
         return "\n".join(ret)
 
+    def _get_bash_telemetry(self, funcname):
+        """return to lines of ``<funcname>_timed`` function, which calls
+        funcname and appends '<unix time> bash <command> <phase>
+        <microseconds>' to log file ($EPOCHREALTIME of bash 5.0 or later).
+        """
+        ret = ["%s_timed()\n{" % funcname]
+        ret.append("  local start=${EPOCHREALTIME//[.,]/} phase=value ret")
+        ret.append("  [[ ${COMP_WORDS[$COMP_CWORD]} == -* ]] && phase=option")
+        ret.append("  %s \"$@\"" % funcname)
+        ret.append("  ret=$?")
+        ret.append("  if [[ -n $start ]]; then")
+        ret.append("    local log=%s" % TELEMETRY_LOG)
+        ret.append("    [[ -d ${log%/*} ]] || mkdir -p \"${log%/*}\"")
+        ret.append("    echo \"${start:0:${#start}-6} bash %s $phase "
+                   "$(( ${EPOCHREALTIME//[.,]/} - start ))\" >> \"$log\"" %
+                   self.commandname)
+        ret.append("  fi")
+        ret.append("  return $ret")
+        ret.append("}\n")
+        return ret
+
+    def _get_zsh_specs(self, equals=False):
+        """return to list of ``_arguments`` specs (quoted) of options.
+
+        with ``equals``, long options taking value are ``--opt=`` specs,
+        whose value is given in the same word after '=' or as next word.
+        """
+        ret = []
+        for entry in self.option_table:
+            metavar = entry['metavar']
+            if (metavar or entry['choices'] or entry['takes_value']) and \
+                    get_user_value_kind(entry, self.completers) is not None:
+                metavar = "::%s:%s" % (_get_value_name(entry),
+                                       self._get_zsh_completer(entry))
+            elif metavar:
+                if self.parser_type == 'argparse' and \
+                        metavar[0] == '{' and metavar[-1] == '}':
+                    metas = metavar[1:-1].split(',')
+                    metavar = "::%s:(%s):" % (metavar, " ".join(metas))
+                else:
+                    metavar = "::%s:%s" % (metavar,
+                                           self._get_zsh_completer(entry))
+            elif entry['choices'] and self.parser_type == 'argparse':
+                metavar = ":::(%s):" % (" ".join(entry['choices']))
+            elif entry['takes_value']:
+                metavar = "::%s:%s" % (_get_value_name(entry),
+                                       self._get_zsh_completer(entry))
+            else:
+                metavar = ""
+
+            for opt in entry['options']:
+                directory_comp = self._get_dircomp(opt)
+                optarg = metavar
+                if equals and metavar and opt.startswith('--'):
+                    # value of '--opt=' spec is not optional
+                    opt, optarg = opt + '=', metavar[1:]
+                if entry['help']:
+                    tmp = "\"%s[%s]%s%s\"" % (opt,
+                                              _escape_strings(entry['help']),
+                                              optarg, directory_comp)
+                else:
+                    tmp = "\"%s%s%s\"" % (opt, optarg, directory_comp)
+                ret.append(tmp)
+        return ret
+
     def _get_zsh_format(self):
         """return to string of zsh completion function format."""
-        if self.parser_type == 'optparse':
-            actions = self.parser.option_list
-        elif self.parser_type == 'argparse':
-            actions = self.parser._actions
         ret = []
         ret.append("#compdef %s" % self.commandname)
         ret.append("#\n# this is zsh completion function file.")
         ret.append("# generated by genzshcomp(ver: %s)\n#\n" % __version__)
         ret.append("typeset -A opt_args")
         ret.append("local context state line\n")
-        ret.append("_arguments -s -S \\")
-        for action in actions:
-            if action.metavar:
-                if self.parser_type == 'argparse' and \
-                        action.metavar[0] == '{' and action.metavar[-1] == '}':
-                    metas = action.metavar[1:-1].split(',')
-                    metavar = "::%s:(%s):" % (action.metavar, " ".join(metas))
-                else:
-                    metavar = "::%s:_files" % action.metavar
-            elif action.choices and self.parser_type == 'argparse':
-                metavar = ":::(%s):" % (" ".join(action.choices))
-            else:
-                metavar = ""
+        body = ["_arguments -s -S \\"]
+        for spec in self._get_zsh_specs():
+            body.append("  %s \\" % spec)
+        body.append("  \"*:args:_files\"")
+        if self.telemetry:
+            body = self._get_zsh_telemetry(body)
+        ret += body
+        return "\n".join(ret)
 
-            if self.parser_type == 'optparse':
-                opts = [i for i in action._long_opts]
-                opts += [i for i in action._short_opts]
-            elif self.parser_type == 'argparse':
-                opts = action.option_strings
-            for opt in opts:
-                directory_comp = self._get_dircomp(opt)
-                if action.help:
-                    tmp = "  \"%s[%s]%s%s\" \\" % (opt,
-                                                   _escape_strings(
-                                                       action.help),
-                                                   metavar, directory_comp)
+    def _get_zsh_telemetry(self, body):
+        """wrap lines of zsh function body with timing, which appends
+        '<unix time> zsh <command> <phase> <microseconds>' to log file.
+
+        phase is 'option' when current word starts with '-', or 'value'.
+        """
+        ret = ["zmodload zsh/datetime 2>/dev/null"]
+        ret.append("local _genzshcomp_start=$EPOCHREALTIME "
+                   "_genzshcomp_phase=value")
+        ret.append("[[ $PREFIX == -* ]] && _genzshcomp_phase=option")
+        ret.append("{")
+        ret += ["  %s" % i if i else i for i in body]
+        ret.append("} always {")
+        ret.append("  if [[ -n $_genzshcomp_start ]]; then")
+        ret.append("    local _genzshcomp_log=%s" % TELEMETRY_LOG)
+        ret.append("    local -i _genzshcomp_us='(EPOCHREALTIME - "
+                   "_genzshcomp_start) * 1000000'")
+        ret.append("    [[ -d ${_genzshcomp_log:h} ]] ||"
+                   " mkdir -p ${_genzshcomp_log:h}")
+        ret.append("    print -r -- \"$EPOCHSECONDS zsh $service "
+                   "$_genzshcomp_phase $_genzshcomp_us\" >>| $_genzshcomp_log")
+        ret.append("  fi")
+        ret.append("}")
+        return ret
+
+    def _get_zsh_large_format(self):
+        """return to string of zsh completion function format for large
+        option sets.
+
+        option names are completed by ``_describe`` from arrays, which are
+        built once and grouped by prefix (first 3 characters) and by kind
+        (long options taking values are completed with '=').
+        ``_arguments`` gets only specs of options taking values, for
+        completion of their values.
+        """
+        # command name is None without usage line in help strings
+        name = "_genzshcomp_large_" + re.sub('[^0-9A-Za-z_]', '_',
+                                             "%s" % self.commandname)
+        groups = {}
+        value_opts = []
+        value_specs = []
+        specs = iter(self._get_zsh_specs(equals=True))
+        for entry in self.option_table:
+            for opt in entry['options']:
+                spec = next(specs)
+                if entry['takes_value']:
+                    value_opts.append(opt)
+                    value_specs.append(spec)
+                if opt.startswith('--'):
+                    key = opt[:3]
+                    kind = 'eqopts' if entry['takes_value'] else 'opts'
                 else:
-                    tmp = "  \"%s%s%s\" \\" % (opt, metavar, directory_comp)
-                ret.append(tmp)
+                    key = opt[:2]
+                    kind = 'opts'
+                item = opt.replace(':', '\\:')
+                if entry['help']:
+                    item += ':' + " ".join(entry['help'].split())
+                groups.setdefault(key, {'opts': [], 'eqopts': []})
+                groups[key][kind].append(item)
+
+        # arrays are sorted by group, and each group is a slice of them
+        arrays = {'opts': [], 'eqopts': []}
+        slices = []
+        for key in sorted(groups):
+            ranges = []
+            for kind in ('opts', 'eqopts'):
+                start = len(arrays[kind]) + 1
+                arrays[kind] += groups[key][kind]
+                if start <= len(arrays[kind]):
+                    ranges.append("%s=(\"${(@)%s_%s[%d,%d]}\")" % (
+                        kind, name, kind, start, len(arrays[kind])))
+            slices.append((key, ranges))
+
+        ret = []
+        ret.append("#compdef %s" % self.commandname)
+        ret.append("#\n# this is zsh completion function file.")
+        ret.append("# generated by genzshcomp(ver: %s)\n#\n" % __version__)
+        for kind in ('opts', 'eqopts'):
+            ret.append("typeset -ga %s_%s" % (name, kind))
+            ret.append("%s_%s=(" % (name, kind))
+            ret += ["  %s" % _zsh_quote(i) for i in arrays[kind]]
+            ret.append(")")
+        ret.append("typeset -ga %s_specs" % name)
+        ret.append("%s_specs=(" % name)
+        ret += ["  %s" % i for i in value_specs]
         ret.append("  \"*:args:_files\"")
+        ret.append(")")
+        ret.append("typeset -gA %s_takes_value" % name)
+        ret.append("%s_takes_value=(%s)" % (
+            name, " ".join("%s 1" % _zsh_quote(i) for i in value_opts)))
+        ret.append("")
+        # autoloaded file redefines its function at first call, and the
+        # arrays above are built only once
+        funcname = "_%s" % self.commandname
+        ret.append("%s() {" % funcname)
+        ret.append("  typeset -A opt_args")
+        ret.append("  local context state line")
+        ret.append("  local -a opts eqopts")
+        body = []
+        body.append("if [[ $PREFIX != -* || $PREFIX == *=* ]] ||")
+        body.append("    (( ${+%s_takes_value[$words[CURRENT-1]]} )); then"
+                    % name)
+        body.append("  _arguments -s -S \"${(@)%s_specs}\"" % name)
+        body.append("  return")
+        body.append("fi")
+        body.append("case ${PREFIX[1,3]} in")
+        for key, ranges in slices:
+            body.append("  (%s) %s ;;" % (_zsh_quote(key), " ".join(ranges)))
+        body.append("  (*) opts=(\"${(@)%s_opts}\")" % name)
+        body.append("      eqopts=(\"${(@)%s_eqopts}\") ;;" % name)
+        body.append("esac")
+        body.append("_describe -t options option opts -- eqopts -qS=")
+        if self.telemetry:
+            body = self._get_zsh_telemetry(body)
+        ret += ["  %s" % i if i else i for i in body]
+        ret.append("}")
+        ret.append("")
+        ret.append("%s \"$@\"" % funcname)
         return "\n".join(ret)
 
     def get(self):
@@ -207,6 +795,16 @@ class CompletionGenerator(object):
         return func()
 
 
+# help option, which is added by parser object itself
+_HELP_OPTION_LINE = re.compile(r"\s+(-h, --help|--help, -h|--help)(\s|$)")
+
+
+def _get_optparse_action(opt):
+    """return to optparse action of option in help strings, which takes
+    value only when it has metavar."""
+    return 'store_true' if opt['metavar'] is None else 'store'
+
+
 class HelpParser(object):
 
     """convert from help-strings to optparse.OptionParser"""
@@ -218,7 +816,8 @@ class HelpParser(object):
                 self.parselines = self.helplines[cnt:]
                 self.parser_type = 'optparse'
                 return
-            elif re.match("optional arguments:", line):
+            elif re.match("optional arguments:|options:", line):
+                # 'options:' since Python 3.10
                 self.parselines = self.helplines[cnt:]
                 self.parser_type = 'argparse'
                 return
@@ -235,6 +834,29 @@ class HelpParser(object):
                 return tmp[1]
         return None
 
+    def get_subcommands(self):
+        """get subcommands ('{name,...}' of argparse) from help strings.
+
+        :return: list of (name, description)
+        :rtype: list
+        """
+        names = []
+        descriptions = {}
+        indent = None
+        for line in self.helplines:
+            if indent is None:
+                match = re.match(r"(\s+)\{([\w.,-]+)\}(\s|$)", line)
+                if match:
+                    indent = len(match.group(1))
+                    names = match.group(2).split(',')
+                continue
+            match = re.match(r"(\s+)(\S+)(\s{2,}(\S.*))?$", line)
+            if not match or len(match.group(1)) <= indent:
+                break
+            if match.group(2) in names:
+                descriptions[match.group(2)] = match.group(4) or ""
+        return [(name, descriptions.get(name, "")) for name in names]
+
     def _get_helpoffset(self):
         """get offset-position of help-strings.
 
@@ -271,12 +893,14 @@ class HelpParser(object):
                     parser.remove_option(opt['short'])
                 parser.add_option(opt['short'], opt['long'],
                                   metavar=opt['metavar'],
+                                  action=_get_optparse_action(opt),
                                   help=opt['help'].strip())
             elif not opt['short'] and self.parser_type is 'optparse':
                 if parser.has_option(opt['short']):
                     parser.remove_option(opt['short'])
                 parser.add_option(opt['long'],
                                   metavar=opt['metavar'],
+                                  action=_get_optparse_action(opt),
                                   help=opt['help'].strip())
             elif opt['long'] and opt['short'] and \
                     self.parser_type is 'argparse':
@@ -325,7 +949,8 @@ class HelpParser(object):
         option_list = []
         # 1 is 'Options' line
         for line in self.parselines[1:]:
-            if line.isspace() or not len(line) or '--help     ' in line:
+            if line.isspace() or not len(line) or \
+                    _HELP_OPTION_LINE.match(line):
                 continue
             tmp = line.split()
             metavar = None
@@ -396,8 +1021,8 @@ class HelpParser(object):
         option_cnt = -1
         option_list = []
         for line in self.parselines[1:]:
-            if line.isspace() or not len(line) or '--help     ' in line or \
-               '--version  ' in line:
+            if line.isspace() or not len(line) or \
+                    _HELP_OPTION_LINE.match(line) or '--version  ' in line:
                 continue
             tmp = line.split()
             metavar = None
@@ -465,25 +1090,1629 @@ class HelpParser(object):
         return self._get_parserobj(option_list)
 
 
+# names which are allowed in arguments of parser calls of SourceParser
+_SOURCE_NAMES = {'int': int, 'float': float, 'str': str, 'complex': complex,
+                 'SUPPRESS': SUPPRESS, 'SUPPRESS_HELP': SUPPRESS_HELP}
+# translation functions, whose argument is used as it is
+_SOURCE_GETTEXT = ('_', 'gettext', 'ugettext', 'N_')
+_SOURCE_PARSERS = {'ArgumentParser': 'argparse', 'OptionParser': 'optparse'}
+# methods which return object to add options to the same parser
+_SOURCE_GROUPS = ('add_argument_group', 'add_mutually_exclusive_group')
+_SOURCE_CALLS = frozenset(tuple(_SOURCE_PARSERS) + _SOURCE_GROUPS +
+                          ('OptionGroup', 'add_argument', 'add_option'))
+_SOURCE_CONSTRUCTOR_KEYWORDS = {
+    'argparse': ('prog', 'usage', 'add_help', 'prefix_chars',
+                 'conflict_handler'),
+    'optparse': ('prog', 'usage', 'add_help_option', 'version',
+                 'conflict_handler')}
+
+
+def _get_dotted_name(node):
+    """return to 'a.b.c' of Name or Attribute node, or None."""
+    import ast
+    names = []
+    while isinstance(node, ast.Attribute):
+        names.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    names.append(node.id)
+    return ".".join(reversed(names))
+
+
+def _get_literal(node):
+    """return to value of literal node, type name, FileType() call or
+    literal of gettext call.
+
+    :raise ValueError: when node is other expression
+    """
+    import ast
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError):
+        pass
+    name = _get_dotted_name(node)
+    if name is not None and name.split('.')[-1] in _SOURCE_NAMES:
+        return _SOURCE_NAMES[name.split('.')[-1]]
+    if isinstance(node, ast.Call):
+        func = (_get_dotted_name(node.func) or '').split('.')[-1]
+        if func in _SOURCE_GETTEXT and len(node.args) == 1:
+            return _get_literal(node.args[0])
+        if func == 'FileType' and argparse is not None:
+            args, kwargs = _get_call_args(node)
+            return argparse.FileType(*args, **kwargs)
+    raise ValueError("not literal: %s" % ast.dump(node))
+
+
+def _get_call_args(node):
+    """return to (args, kwargs) of Call node with literal arguments.
+
+    keyword arguments which are not literal are dropped.
+
+    :raise ValueError: when positional arguments are not literal
+    """
+    args = []
+    for arg in node.args:
+        args.append(_get_literal(arg))
+    if getattr(node, 'starargs', None) is not None:
+        raise ValueError("*args of call")
+    kwargs = {}
+    for keyword in node.keywords:
+        if keyword.arg is None:
+            continue
+        try:
+            kwargs[keyword.arg] = _get_literal(keyword.value)
+        except ValueError:
+            pass
+    return args, kwargs
+
+
+class SourceParser(object):
+
+    """convert from Python source code to option parser object.
+
+    the source code is never executed. ``ArgumentParser()`` and
+    ``OptionParser()`` calls, and ``add_argument()`` and ``add_option()``
+    calls of them (and of their groups) are read with ``ast``. calls with
+    arguments which are not literal are skipped, and so are keyword
+    arguments which are not literal.
+    """
+
+    def __init__(self, source, filename='<source>'):
+        import ast
+        tree = ast.parse(source, filename)
+        targets = {}
+        calls = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Assign):
+                if isinstance(node.value, ast.Call):
+                    names = [_get_dotted_name(i) for i in node.targets]
+                    targets[id(node.value)] = [i for i in names if i]
+            elif isinstance(node, ast.Call):
+                func = node.func
+                name = getattr(func, 'attr', None) or getattr(func, 'id', None)
+                if name in _SOURCE_CALLS:
+                    calls.append(node)
+        calls.sort(key=lambda node: (node.lineno, node.col_offset))
+
+        self.parser_type = None
+        self.constructor_kwargs = {}
+        self.calls = []
+        parser_names = set()
+        for node in calls:
+            name = _get_dotted_name(node.func)
+            if name is None:
+                continue
+            basename = name.split('.')[-1]
+            if basename in _SOURCE_PARSERS:
+                if self.parser_type is None:
+                    self.parser_type = _SOURCE_PARSERS[basename]
+                    try:
+                        self.constructor_kwargs = _get_call_args(node)[1]
+                    except ValueError:
+                        pass
+                if self.parser_type == _SOURCE_PARSERS[basename]:
+                    parser_names.update(targets.get(id(node), ()))
+                continue
+            owner = name.rsplit('.', 1)[0] if '.' in name else None
+            if basename == 'OptionGroup' and node.args and \
+                    _get_dotted_name(node.args[0]) in parser_names:
+                parser_names.update(targets.get(id(node), ()))
+            elif owner not in parser_names:
+                continue
+            elif basename in _SOURCE_GROUPS:
+                parser_names.update(targets.get(id(node), ()))
+            elif basename in ('add_argument', 'add_option'):
+                self.calls.append(node)
+        if self.parser_type is None:
+            raise InvalidParserTypeError("parser is not found in %s" %
+                                         filename)
+
+    def get_commandname(self):
+        """get command name from 'prog' of parser, or None."""
+        prog = self.constructor_kwargs.get('prog')
+        return prog if isinstance(prog, str) else None
+
+    def source2parseobj(self):
+        """convert from source code to optparse.OptionParser or
+        argparse.ArgumentParser object."""
+        keywords = _SOURCE_CONSTRUCTOR_KEYWORDS[self.parser_type]
+        kwargs = dict((key, value) for key, value in
+                      self.constructor_kwargs.items() if key in keywords)
+        if self.parser_type == 'optparse':
+            parser = OptionParser(**kwargs)
+            method = parser.add_option
+        else:
+            parser = ArgumentParser(**kwargs)
+            method = parser.add_argument
+        for node in self.calls:
+            try:
+                args, kwargs = _get_call_args(node)
+                method(*args, **kwargs)
+            except Exception:
+                # not literal, or not valid for parser
+                continue
+        return parser
+
+
+PRINT_COMPLETION_OPTION = '--print-completion'
+OUTPUT_FORMATS = ('zsh', 'zsh_large', 'bash', 'list', 'json')
+
+
+def install(parser, option=PRINT_COMPLETION_OPTION, commandname=None,
+            cache_dir=None):
+    """add hidden option to print completion function of parser itself.
+
+    call this after all options are added. ``prog --print-completion zsh``
+    prints completion function from the live parser (see
+    :func:`get_completion`) and exits in parse_args().
+
+    :param parser: optparse.OptionParser or argparse.ArgumentParser
+    :param option: option string of hidden option
+    :param commandname: command name (default: prog of parser)
+    :param cache_dir: directory of rendered completion cache
+    """
+    parser_type = get_parser_type(parser)
+
+    def print_completion(output_format):
+        name = commandname
+        if name is None:
+            if parser_type == 'optparse':
+                name = parser.get_prog_name()
+            else:
+                name = parser.prog
+        print(get_completion(name, parser, output_format,
+                             cache_dir=cache_dir))
+
+    if parser_type == 'optparse':
+        def callback(opt_obj, opt_str, value, opt_parser):
+            print_completion(value)
+            opt_parser.exit()
+        parser.add_option(option, type='choice', choices=list(OUTPUT_FORMATS),
+                          action='callback', callback=callback,
+                          help=SUPPRESS_HELP)
+    else:
+        class PrintCompletionAction(argparse.Action):
+            def __call__(self, arg_parser, namespace, values,
+                         option_string=None):
+                print_completion(values)
+                arg_parser.exit()
+        parser.add_argument(option, choices=OUTPUT_FORMATS,
+                            action=PrintCompletionAction, help=SUPPRESS)
+    return parser
+
+
+COMPLETION_DATA_DIRS = {
+    'zsh': ('share/zsh/site-functions', '_%s'),
+    'bash': ('share/bash-completion/completions', '%s'),
+}
+
+
+def _load_factory(spec):
+    """import 'module:factory' and return to factory object."""
+    modname, _, funcname = spec.partition(':')
+    module = __import__(modname, fromlist=[funcname])
+    obj = module
+    for name in funcname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+_cmdclass = {}
+
+
+def get_cmdclass():
+    """return to ``cmdclass`` for setup(), with build_completion command.
+
+    setuptools is imported at first call, not at import of genzshcomp.
+    """
+    if _cmdclass:
+        return dict(_cmdclass)
+    try:
+        from setuptools import Command
+        try:
+            from setuptools.command.build import build as _build
+        except ImportError:
+            from distutils.command.build import build as _build
+    except ImportError:
+        raise ImportError("setuptools is required for build_completion")
+
+    class BuildCompletion(Command):
+
+        """setuptools command, generate completion files at build time.
+
+        parsers are given as 'command=module:factory' lines, the factory
+        is called with no arguments and returns to parser object::
+
+            [build_completion]
+            completion_parsers =
+                grin = grin:get_grin_arg_parser
+
+        generated files are added to ``data_files`` and installed into
+        share/zsh/site-functions and share/bash-completion/completions.
+        """
+
+        description = "generate zsh/bash completion function files"
+        user_options = [
+            ('completion-parsers=', None,
+             "'command=module:factory' list of parser factories"),
+            ('formats=', None, "output formats (default: zsh,bash)"),
+            ('build-dir=', 'd', "directory to build completion files"),
+        ]
+
+        def initialize_options(self):
+            self.completion_parsers = None
+            self.formats = None
+            self.build_dir = None
+            self.build_lib = None
+
+        def finalize_options(self):
+            self.set_undefined_options('build', ('build_lib', 'build_lib'))
+            if self.build_dir is None:
+                build = self.get_finalized_command('build')
+                self.build_dir = os.path.join(build.build_base, 'completion')
+            self.completion_parsers = self._split(self.completion_parsers)
+            self.formats = self._split(self.formats) or ['zsh', 'bash']
+            for fmt in self.formats:
+                if fmt not in COMPLETION_DATA_DIRS:
+                    raise InvalidParserTypeError("Invalid output format."
+                                                 " format='%s'" % fmt)
+
+        @staticmethod
+        def _split(value):
+            if not value:
+                return []
+            if isinstance(value, (list, tuple)):
+                return list(value)
+            return value.replace(',', '\n').split()
+
+        def _get_parsers(self):
+            # 'cmd = mod:func' is split to three words in setup.cfg
+            specs = " ".join(self.completion_parsers).replace(' = ', '=')
+            for spec in specs.split():
+                commandname, _, factory = spec.partition('=')
+                yield commandname, _load_factory(factory)()
+
+        def run(self):
+            if self.distribution.has_pure_modules():
+                self.run_command('build_py')
+            sys.path.insert(0, os.path.abspath(self.build_lib))
+            try:
+                parsers = list(self._get_parsers())
+            finally:
+                sys.path.pop(0)
+            data_files = {}
+            for fmt in self.formats:
+                datadir, filename = COMPLETION_DATA_DIRS[fmt]
+                outdir = os.path.join(self.build_dir, fmt)
+                self.mkpath(outdir)
+                for commandname, parser in parsers:
+                    outfile = os.path.join(outdir, filename % commandname)
+                    compobj = CompletionGenerator(commandname, parser,
+                                                  output_format=fmt)
+                    self.execute(self._write, (outfile, compobj.get()),
+                                 "generating %s" % outfile)
+                    data_files.setdefault(datadir, []).append(outfile)
+            if self.distribution.data_files is None:
+                self.distribution.data_files = []
+            self.distribution.data_files.extend(sorted(data_files.items()))
+
+        @staticmethod
+        def _write(outfile, output):
+            with open(outfile, 'w') as fobj:
+                fobj.write(output + "\n")
+
+    class BuildWithCompletion(_build):
+
+        """build command, which runs build_completion too."""
+
+        sub_commands = _build.sub_commands + [('build_completion', None)]
+
+    _cmdclass.update({'build': BuildWithCompletion,
+                      'build_completion': BuildCompletion})
+    return dict(_cmdclass)
+
+
+COMPLETION_FILENAMES = {'zsh': '_%s', 'zsh_large': '_%s', 'bash': '%s',
+                        'list': '%s.list', 'json': '%s.json'}
+SHARED_FUNCTION_PREFIX = '_genzshcomp_'
+MANIFEST_FILENAME = '.genzshcomp.json'
+MANIFEST_VERSION = 1
+BULK_OPTIONS = ('output_format', 'dedup', 'bundle', 'lazy', 'telemetry',
+                'zcompile', 'cache_dir')
+
+
+def get_bash_completion_dir():
+    """return to user directory of bash-completion's on-demand loader.
+
+    files in it are sourced by ``_completion_loader`` at the first
+    completion of the command, not at bash startup.
+    ``$BASH_COMPLETION_USER_DIR`` is colon separated list, which the loader
+    searches in order, so the first entry is used.
+    """
+    user_dirs = os.environ.get('BASH_COMPLETION_USER_DIR', '').split(':')
+    user_dir = ([i for i in user_dirs if i] or [None])[0]
+    if not user_dir:
+        data_home = os.environ.get('XDG_DATA_HOME') or \
+            os.path.join(os.path.expanduser('~'), '.local', 'share')
+        user_dir = os.path.join(data_home, 'bash-completion')
+    return os.path.join(user_dir, 'completions')
+
+
+def _to_kb(maxrss):
+    """ru_maxrss to KB, which is bytes on Mac OS X."""
+    return maxrss // 1024 if sys.platform == 'darwin' else maxrss
+
+
+# runs command by /bin/sh in a child, copies its stdout, and appends
+# '\0<maxrss of child> <maxrss of itself>'. a child inherits peak RSS of
+# its parent at fork, so a small python process (-S) lowers the floor.
+_MAXRSS_WRAPPER = r"""
+import os, resource, sys
+r, w = os.pipe()
+try:
+    # peak RSS of memory of this process (ru_maxrss includes the parent's)
+    with open('/proc/self/status') as fobj:
+        floor = [int(i.split()[1]) for i in fobj if i.startswith('VmHWM:')][0]
+except (IOError, OSError, IndexError):
+    floor = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+pid = os.fork()
+if pid == 0:
+    try:
+        os.close(r)
+        os.dup2(w, 1)
+        os.execv('/bin/sh', ['/bin/sh', '-c', sys.argv[1]])
+    finally:
+        os._exit(127)
+os.close(w)
+def write(data):
+    while data:
+        data = data[os.write(1, data):]
+while True:
+    data = os.read(r, 65536)
+    if not data:
+        break
+    write(data)
+status, rusage = os.wait4(pid, 0)[1:]
+write(('\0%d %d' % (rusage.ru_maxrss, floor)).encode('ascii'))
+sys.exit(os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1)
+"""
+
+
+def get_help_text(command, stats=None):
+    """run command with '--help' and return to its help strings.
+
+    when ``stats`` is dict, peak RSS (KB) of the command is set to its
+    'maxrss', and peak RSS of the process which runs it to 'maxrss_floor'.
+    the command inherits the floor at fork, so 'maxrss' is None when it
+    is not larger than the floor (or not available).
+    """
+    cmd = command.strip()
+    if not (cmd.endswith(' --help') or cmd.endswith(' -h')):
+        cmd += ' --help'
+    if stats is None or not hasattr(os, 'wait4'):
+        helptext = subprocess.check_output(cmd, shell=True)
+        if stats is not None:
+            stats['maxrss'] = stats['maxrss_floor'] = None
+    else:
+        proc = subprocess.Popen([sys.executable, '-S', '-c', _MAXRSS_WRAPPER,
+                                 cmd], stdout=subprocess.PIPE)
+        output = proc.communicate()[0]
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+        pos = output.rfind(b'\0')
+        helptext = output[:pos]
+        maxrss, floor = [_to_kb(int(i)) for i in output[pos + 1:].split()]
+        stats['maxrss'] = maxrss if maxrss > floor else None
+        stats['maxrss_floor'] = floor
+    if not isinstance(helptext, str):
+        helptext = helptext.decode('utf-8', 'replace')
+    return helptext
+
+
+def get_runner_time(runs=3):
+    """return to seconds to start the runner of :func:`get_help_text` with
+    stats (the shortest of runs), which 'capture_time' of report includes,
+    or None when the runner is not used."""
+    if not hasattr(os, 'wait4'):
+        return None
+    ret = None
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_output([sys.executable, '-S', '-c',
+                                 _MAXRSS_WRAPPER, ':'])
+        elapsed = time.time() - start
+        ret = elapsed if ret is None else min(ret, elapsed)
+    return ret
+
+
+def generate_bulk(generators, dedup=False, stats=None, owners=None):
+    """render completion files of generators.
+
+    with ``dedup``, zsh functions of commands which have identical option
+    set are written once, as shared function file
+    ``_genzshcomp_<hash>`` whose ``#compdef`` line lists all of them.
+
+    :param generators: list of CompletionGenerator
+    :param stats: dict of {command name: dict}, 'render_time' and 'size'
+                  of output are set to
+    :param owners: dict, {filename: [command names]} of files are set to
+    :return: dict of {filename: content}
+    """
+    if owners is None:
+        owners = {}
+    files = {}
+    groups = {}
+    for compobj in generators:
+        start = time.time()
+        output = compobj.get()
+        if stats is not None and compobj.commandname in stats:
+            stats[compobj.commandname]['render_time'] = time.time() - start
+            stats[compobj.commandname]['size'] = len(output.encode('utf-8'))
+        filename = COMPLETION_FILENAMES[compobj.output_format] % \
+            compobj.commandname
+        if not dedup or compobj.output_format != 'zsh':
+            files[filename] = output
+            owners[filename] = [compobj.commandname]
+            continue
+        # body of zsh function does not contain command name
+        body = output.split("\n", 1)[1]
+        digest = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        groups.setdefault(digest, (body, [], []))
+        groups[digest][1].append(compobj.commandname)
+        groups[digest][2].append(filename)
+    for digest, (body, commandnames, filenames) in groups.items():
+        if len(commandnames) == 1:
+            filename = filenames[0]
+        else:
+            filename = SHARED_FUNCTION_PREFIX + digest[:12]
+        files[filename] = "#compdef %s\n%s" % (" ".join(commandnames), body)
+        owners[filename] = commandnames
+    return files
+
+
+def generate_bundle(files, dirvar=None):
+    """bundle zsh completion files to one file, to source after compinit.
+
+    :param files: dict of {filename: content} of zsh format
+    :param dirvar: name of global variable, which the bundle sets to its
+                   own directory (for stubs of :func:`generate_lazy`)
+    :return: content of bundle file
+    """
+    ret = []
+    ret.append("#\n# this is zsh completion bundle file.")
+    ret.append("# generated by genzshcomp(ver: %s)\n#" % __version__)
+    ret.append("# source it after compinit.\n#\n")
+    if dirvar:
+        ret.append("typeset -g " + dirvar + "=${${(%):-%x}:A:h}\n")
+    for filename, output in sorted(files.items()):
+        lines = output.splitlines()
+        commandnames = lines[0].split()[1:]
+        ret.append("%s() {" % filename)
+        body = [i for i in lines[1:] if not i.startswith('#')]
+        while body and not body[0]:
+            body.pop(0)
+        for line in body:
+            ret.append("  %s" % line if line else "")
+        ret.append("}")
+        ret.append("compdef %s %s\n" % (filename, " ".join(commandnames)))
+    return "\n".join(ret)
+
+
+def generate_lazy(files, dirvar):
+    """split zsh completion files to small stubs and spec files.
+
+    a stub loads ``$<dirvar>/<name>.zspec`` into global array at first
+    completion, and passes it to ``_arguments`` from then on. stubs are
+    for the bundle file, which sets dirvar to its directory, so the
+    output directory can be moved.
+
+    :param files: dict of {filename: content} of zsh format
+    :param dirvar: name of global variable of spec directory
+    :return: tuple of (stubs, spec files), dict of {filename: content}
+    """
+    stubs = {}
+    specfiles = {}
+    for filename, output in files.items():
+        lines = output.splitlines()
+        start = lines.index("_arguments -s -S \\") + 1
+        specs = [i.rstrip(" \\") for i in lines[start:]]
+        specname = "%s.zspec" % filename.lstrip('_')
+        varname = "_genzshcomp_spec_" + re.sub('[^0-9A-Za-z_]', '_',
+                                                 filename)
+        stub = lines[:start - 1]
+        stub.append("(( ${+%s} )) ||" % varname)
+        stub.append("  source \"${%s}/%s\"" % (dirvar, specname))
+        stub.append("_arguments -s -S \"${%s[@]}\"" % varname)
+        stubs[filename] = "\n".join(stub)
+        spec = ["# genzshcomp(ver: %s) spec of %s" % (__version__, filename)]
+        spec.append("typeset -ga %s" % varname)
+        spec.append("%s=(" % varname)
+        spec += specs
+        spec.append(")")
+        specfiles[specname] = "\n".join(spec)
+    return stubs, specfiles
+
+
+def _get_command_name(command, help_parser):
+    """return to command name in usage line of help strings ('tool.py' of
+    'python tool.py'), or basename of the first word of command line."""
+    name = help_parser.get_commandname()
+    if name:
+        return os.path.basename(name)
+    return os.path.basename(command.split()[0])
+
+
+def discover_subcommands(command, max_depth=2, jobs=8):
+    """run '--help' of command and its subcommands recursively.
+
+    help strings of the same depth are got in parallel. option blocks
+    which have the same text are parsed once.
+
+    :param max_depth: max depth of subcommands
+    :param jobs: number of parallel help commands
+    :return: tree of dict: 'name', 'command', 'description',
+             'parser_type', 'options' (option table) and 'subcommands'
+             (list of trees)
+    """
+    parsed = {}
+
+    def parse(node):
+        try:
+            help_parser = HelpParser(get_help_text(node['command']))
+            key = "\n".join(help_parser.parselines)
+            if key not in parsed:
+                parsed[key] = get_option_table(help_parser.help2parseobj(),
+                                               help_parser.parser_type)
+        except Exception as exc:
+            sys.stderr.write("genzshcomp: %s: %s\n" % (node['command'], exc))
+            return node, None
+        node['parser_type'] = help_parser.parser_type
+        node['options'] = parsed[key]
+        if node is root:
+            node['name'] = _get_command_name(command, help_parser)
+        return node, help_parser.get_subcommands()
+
+    from multiprocessing.pool import ThreadPool
+    root = {'name': os.path.basename(command.split()[0]),
+            'command': command, 'description': "",
+            'parser_type': 'argparse', 'options': [], 'subcommands': []}
+    pool = ThreadPool(jobs)
+    try:
+        level = [root]
+        for depth in range(max_depth + 1):
+            children = []
+            for node, subcommands in pool.map(parse, level):
+                if depth == max_depth or not subcommands:
+                    continue
+                for name, description in subcommands:
+                    child = {'name': name, 'description': description,
+                             'command': "%s %s" % (node['command'], name),
+                             'parser_type': 'argparse', 'options': [],
+                             'subcommands': []}
+                    node['subcommands'].append(child)
+                    children.append(child)
+            if not children:
+                break
+            level = children
+    finally:
+        pool.close()
+    return root
+
+
+def generate_zsh_tree(tree, completers=None):
+    """return to zsh completion function of tree of subcommands.
+
+    :param tree: return value of :func:`discover_subcommands`
+    """
+    funcs = []
+    bodies = {}
+
+    def render(node, funcname):
+        compobj = CompletionGenerator(node['name'], None, node['parser_type'],
+                                      completers=completers,
+                                      option_table=node['options'])
+        lines = ["typeset -A opt_args", "local context state line"]
+        specs = compobj._get_zsh_specs()
+        if not node['subcommands']:
+            lines.append("_arguments -s -S \\")
+            lines += ["  %s \\" % i for i in specs]
+            lines.append("  \"*:args:_files\"")
+            body = "\n".join(lines)
+            # subcommands which have the same options share one function
+            if body in bodies:
+                return bodies[body]
+            bodies[body] = funcname
+            funcs.append((funcname, body))
+            return funcname
+        lines.append("_arguments -C -s -S \\")
+        lines += ["  %s \\" % i for i in specs]
+        lines.append("  \"1: :->subcommand\" \\")
+        lines.append("  \"*::arg:->args\"")
+        lines.append("case $state in")
+        lines.append("  subcommand)")
+        lines.append("    local -a subcommands")
+        lines.append("    subcommands=(")
+        for child in node['subcommands']:
+            if child['description']:
+                lines.append("      \"%s:%s\"" % (
+                    child['name'], _escape_strings(child['description'])))
+            else:
+                lines.append("      \"%s\"" % child['name'])
+        lines.append("    )")
+        lines.append("    _describe 'subcommand' subcommands")
+        lines.append("    ;;")
+        lines.append("  args)")
+        lines.append("    case $words[1] in")
+        index = len(funcs)
+        funcs.append(None)
+        for child in node['subcommands']:
+            childfunc = render(child, "%s_%s" % (
+                funcname, re.sub('[^0-9A-Za-z_]', '_', child['name'])))
+            lines.append("      %s) %s ;;" % (child['name'], childfunc))
+        lines.append("    esac")
+        lines.append("    ;;")
+        lines.append("esac")
+        funcs[index] = (funcname, "\n".join(lines))
+        return funcname
+
+    rootfunc = render(tree, "_%s" % tree['name'])
+    ret = []
+    ret.append("#compdef %s" % tree['name'])
+    ret.append("#\n# this is zsh completion function file.")
+    ret.append("# generated by genzshcomp(ver: %s)\n#\n" % __version__)
+    for funcname, body in funcs:
+        ret.append("%s() {" % funcname)
+        ret += ["  %s" % i if i else "" for i in body.splitlines()]
+        ret.append("}\n")
+    ret.append('%s "$@"' % rootfunc)
+    return "\n".join(ret)
+
+
+def zcompile(path):
+    """compile zsh script to wordcode file (path + '.zwc') with zsh."""
+    subprocess.check_call(['zsh', '-f', '-c', 'zcompile -- "$1"', 'zsh',
+                           path])
+    return path + '.zwc'
+
+
+def _is_generated(path):
+    """return True when the file is written by genzshcomp."""
+    try:
+        with open(path) as fobj:
+            head = fobj.read(256)
+    except (IOError, OSError, UnicodeDecodeError):
+        return False
+    return 'genzshcomp(ver:' in head or '"generator": "genzshcomp' in head
+
+
+def write_completions(files, output_dir, prune=False):
+    """write rendered completion files to output_dir.
+
+    files which have the same content are not rewritten, so their mtime
+    (and zsh's .zcompdump) stays valid.
+
+    :param files: dict of {filename: content}
+    :param prune: remove other files written by genzshcomp
+    :return: dict of 'added', 'changed', 'unchanged' and 'removed'
+             filename lists
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    report = {'added': [], 'changed': [], 'unchanged': [], 'removed': []}
+    for filename, output in sorted(files.items()):
+        path = os.path.join(output_dir, filename)
+        output += "\n"
+        if os.path.exists(path):
+            with open(path) as fobj:
+                if fobj.read() == output:
+                    report['unchanged'].append(filename)
+                    continue
+            report['changed'].append(filename)
+        else:
+            report['added'].append(filename)
+        write_atomic(path, output)
+    if prune:
+        for filename in sorted(os.listdir(output_dir)):
+            path = os.path.join(output_dir, filename)
+            if filename in files or filename == MANIFEST_FILENAME or \
+                    not os.path.isfile(path) or not _is_generated(path):
+                continue
+            os.remove(path)
+            if os.path.exists(path + '.zwc'):
+                os.remove(path + '.zwc')
+            report['removed'].append(filename)
+    return report
+
+
+def _remove_replaced(output_dir, previous, owners, report):
+    """remove files of previous run, which are replaced by files of owners.
+
+    a file is removed when all of its commands are regenerated into other
+    files (e.g. shared function of --dedup, after options of one command
+    are changed), and its ``#compdef`` line is rewritten without them when
+    some of its commands are not regenerated.
+
+    :param previous: dict of {filename: [command names]} of previous run
+    :param owners: dict of {filename: [command names]} of this run
+    :return: dict of {filename: [command names]} of files in output_dir
+    """
+    regenerated = set(i for names in owners.values() for i in names)
+    ret = {}
+    for filename, commandnames in sorted(previous.items()):
+        path = os.path.join(output_dir, filename)
+        if filename in owners or not os.path.isfile(path):
+            continue
+        remaining = [i for i in commandnames if i not in regenerated]
+        if remaining == commandnames:
+            ret[filename] = commandnames
+            continue
+        if remaining:
+            with open(path) as fobj:
+                lines = fobj.read().split("\n", 1)
+            if lines[0].startswith('#compdef ') and len(lines) == 2:
+                write_atomic(path, "#compdef %s\n%s" % (" ".join(remaining),
+                                                         lines[1]))
+                report['changed'].append(filename)
+                ret[filename] = remaining
+                continue
+        os.remove(path)
+        if os.path.exists(path + '.zwc'):
+            os.remove(path + '.zwc')
+        report['removed'].append(filename)
+    ret.update(owners)
+    return ret
+
+
+def write_bulk(generators, output_dir, options, prune=False, stats=None):
+    """render generators with options of bulk mode, and write them to
+    output_dir.
+
+    files of the previous run recorded in manifest, which are replaced by
+    files of this run, are removed (see :func:`_remove_replaced`).
+
+    :param options: dict of BULK_OPTIONS, as stored in manifest
+    :param stats: dict of {command name: dict}, passed to generate_bulk
+    :return: report of write_completions, with 'files', dict of
+             {filename: [command names]} to record in manifest
+    """
+    for compobj in generators:
+        compobj.telemetry = options.get('telemetry', False)
+    owners = {}
+    files = generate_bulk(generators, dedup=options.get('dedup', False),
+                          stats=stats, owners=owners)
+    if options.get('bundle'):
+        bundle = options['bundle']
+        dirvar = None
+        specfiles = {}
+        if options.get('lazy'):
+            dirvar = "_genzshcomp_dir_" + re.sub('[^0-9A-Za-z_]', '_',
+                                                  bundle)
+            files, specfiles = generate_lazy(files, dirvar)
+        owners = dict(("%s.zspec" % filename.lstrip('_'), owners[filename])
+                      for filename in files if specfiles)
+        owners[bundle] = [compobj.commandname for compobj in generators]
+        specfiles[bundle] = generate_bundle(files, dirvar)
+        files = specfiles
+    previous = None if prune else read_manifest(output_dir)
+    report = write_completions(files, output_dir, prune=prune)
+    report['files'] = _remove_replaced(
+        output_dir, previous.get('files', {}) if previous else {}, owners,
+        report)
+    if options.get('zcompile'):
+        for filename in sorted(files):
+            path = os.path.join(output_dir, filename)
+            if filename not in report['unchanged'] or \
+                    not os.path.exists(path + '.zwc'):
+                zcompile(path)
+    return report
+
+
+def read_manifest(output_dir):
+    """return to manifest of output_dir written in bulk mode, or None."""
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fobj:
+        manifest = json.load(fobj)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError("unsupported manifest version: %r" %
+                         manifest.get('version'))
+    return manifest
+
+
+def write_manifest(output_dir, options, commands, files, prune=False):
+    """write options, commands and files ({filename: [command names]},
+    see :func:`write_bulk`) of bulk mode to manifest of output_dir, for
+    ``genzshcomp watch`` to regenerate files in the same way.
+
+    commands of the previous manifest are kept, when its options are the
+    same and the files of them are not removed (not ``prune`` nor
+    ``bundle``, which rewrites the bundle file with given commands only).
+    """
+    previous = read_manifest(output_dir)
+    commands = list(commands)
+    if previous and previous['options'] == options and not prune and \
+            not options.get('bundle'):
+        commands = previous['commands'] + [i for i in commands
+                                           if i not in previous['commands']]
+    manifest = {'generator': "genzshcomp %s" % __version__,
+                'version': MANIFEST_VERSION,
+                'options': options, 'commands': commands, 'files': files}
+    write_atomic(os.path.join(output_dir, MANIFEST_FILENAME),
+                 json.dumps(manifest, indent=1, sort_keys=True) + "\n")
+
+
+def print_report(report, fobj=None):
+    """print added, changed and removed files, and summary line."""
+    fobj = fobj or sys.stdout
+    for key in ('added', 'changed', 'removed'):
+        for filename in report[key]:
+            fobj.write("%s: %s\n" % (key, filename))
+    fobj.write("%d added, %d changed, %d removed, %d unchanged\n" %
+               tuple(len(report[i]) for i in ('added', 'changed', 'removed',
+                                               'unchanged')))
+
+
+def _which(name):
+    """return to path of command on $PATH, or None."""
+    if os.sep in name:
+        return name if os.path.isfile(name) else None
+    for dirname in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(dirname, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def get_command_files(command):
+    """return to absolute paths of files, which help strings of command
+    depend on: its executable and files among its arguments ('tool.py' of
+    'python tool.py'). [] when the executable is not found."""
+    words = command.split()
+    path = _which(words[0])
+    if path is None:
+        return []
+    return [os.path.abspath(i)
+            for i in [path] + [i for i in words[1:] if os.path.isfile(i)]]
+
+
+INTERPRETER_RE = re.compile(r'^(python|pypy|perl|ruby|node|sh|bash|zsh)'
+                            r'[0-9.]*$')
+
+
+def get_help_cache_key(command):
+    """return to cache key of command: version of genzshcomp, command line,
+    path, mtime and size of its executable and of every file among its
+    arguments ('tool.py' of 'python tool.py'). None when the executable is
+    not found, or when it is an interpreter without a script file
+    ('python -m tool'), whose help can change without any file of command
+    line changing."""
+    files = get_command_files(command)
+    if not files or (len(files) == 1 and
+                     INTERPRETER_RE.match(os.path.basename(files[0]))):
+        return None
+    key = [__version__, command.strip()]
+    for i in files:
+        stat = os.stat(i)
+        key.append("%s %r %d" % (i, stat.st_mtime, stat.st_size))
+    return " ".join(key)
+
+
+def _get_generators(commands, output_format, completers, stats=None,
+                    cache_dir=None):
+    """run commands with '--help', and return to (generators, status).
+
+    with ``cache_dir``, option tables are cached in JSON format, until
+    executable of the command is changed. when ``stats`` is list, dict of
+    costs of each command is appended to it (see get_resource_report), and
+    commands are run under the runner of :func:`get_help_text`, which
+    measures their peak RSS. without it, commands are run directly.
+    """
+    status = 0
+    generators = []
+    runner_time = False
+    if cache_dir and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    for command in commands:
+        stat = {'command': command,
+                'name': os.path.basename(command.split()[0]), 'error': None,
+                'cache': None, 'capture_time': None, 'parse_time': None,
+                'render_time': None, 'size': None, 'options': None,
+                'maxrss': None, 'maxrss_floor': None, 'runner_time': None}
+        if stats is not None:
+            stats.append(stat)
+        cache_file = key = None
+        if cache_dir:
+            key = get_help_cache_key(command)
+            digest = hashlib.sha1(command.strip().encode('utf-8'))
+            cache_file = os.path.join(cache_dir,
+                                      "%s.json.cache" % digest.hexdigest())
+            cached = _read_cache(cache_file, key) if key else None
+            if key:
+                stat['cache'] = 'miss' if cached is None else 'hit'
+            if cached is not None:
+                start = time.time()
+                compobj = load_json(cached, output_format=output_format,
+                                    completers=completers)
+                stat['name'] = compobj.commandname
+                stat['options'] = len(compobj.option_table)
+                stat['parse_time'] = time.time() - start
+                generators.append(compobj)
+                continue
+        try:
+            start = time.time()
+            if stats is None:
+                helptext = get_help_text(command)
+            else:
+                if runner_time is False:
+                    runner_time = get_runner_time()
+                    start = time.time()
+                helptext = get_help_text(command, stat)
+                stat['runner_time'] = runner_time
+            stat['capture_time'] = time.time() - start
+            start = time.time()
+            help_parser = HelpParser(helptext)
+            option_parser = help_parser.help2parseobj()
+            stat['name'] = _get_command_name(command, help_parser)
+            compobj = CompletionGenerator(
+                stat['name'], option_parser, output_format=output_format,
+                completers=completers)
+            stat['options'] = len(compobj.option_table)
+            stat['parse_time'] = time.time() - start
+        except Exception as exc:
+            sys.stderr.write("genzshcomp: %s: %s\n" % (command, exc))
+            stat['error'] = str(exc)
+            status = 1
+            continue
+        generators.append(compobj)
+        if cache_file and key:
+            try:
+                write_atomic(cache_file,
+                             key + "\n" + compobj._get_json_format())
+            except (IOError, OSError):
+                pass
+    return generators, status
+
+
+REPORT_FORMAT_VERSION = 1
+_REPORT_METRICS = ('capture_time', 'parse_time', 'render_time', 'size',
+                   'options', 'maxrss')
+
+
+def _percentile(values, percent):
+    """return to nearest-rank percentile of sorted values."""
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(index, 0)]
+
+
+def get_resource_report(stats, top=10):
+    """return to report dict of costs of commands in bulk generation.
+
+    :param stats: list of dict of each command: 'command', 'name',
+                  'error', 'cache' ('hit', 'miss' or None without cache),
+                  'capture_time', 'parse_time', 'render_time' (seconds),
+                  'size' (bytes of output), 'options' (number of options)
+                  and 'maxrss' (peak RSS of help command in KB)
+    :param top: number of commands in 'top' lists
+    :return: dict of 'commands' (stats), 'summary' (count, total, p50, p90,
+             p99 and max of each metric, 'maxrss_floor' and 'runner_time')
+             and 'top'
+             (list of [command, value] of each metric, the largest first)
+    """
+    summary = {'commands': len(stats),
+               'errors': len([i for i in stats if i['error']]),
+               'cache_hits': len([i for i in stats if i['cache'] == 'hit']),
+               'cache_misses': len([i for i in stats
+                                    if i['cache'] == 'miss'])}
+    tops = {}
+    for metric in _REPORT_METRICS:
+        values = sorted(i[metric] for i in stats if i[metric] is not None)
+        if not values:
+            summary[metric] = None
+            tops[metric] = []
+            continue
+        summary[metric] = {'count': len(values), 'total': sum(values),
+                           'p50': _percentile(values, 50),
+                           'p90': _percentile(values, 90),
+                           'p99': _percentile(values, 99),
+                           'max': values[-1]}
+        ranked = sorted((i for i in stats if i[metric] is not None),
+                        key=lambda i: i[metric], reverse=True)
+        tops[metric] = [[i['command'], i[metric]] for i in ranked[:top]]
+    floors = [i['maxrss_floor'] for i in stats
+              if i.get('maxrss_floor') is not None]
+    summary['maxrss_floor'] = max(floors) if floors else None
+    runner_times = [i['runner_time'] for i in stats
+                    if i.get('runner_time') is not None]
+    summary['runner_time'] = max(runner_times) if runner_times else None
+    return {'version': REPORT_FORMAT_VERSION,
+            'generator': 'genzshcomp %s' % __version__,
+            'commands': stats, 'summary': summary, 'top': tops}
+
+
+def _store_main(args, completers):
+    """store option tables of commands into SQLite database."""
+    generators, status = _get_generators(args.commands, args.output_format,
+                                         completers, cache_dir=args.cache_dir)
+    store = CompletionStore(args.db)
+    try:
+        for compobj in generators:
+            store.update(compobj)
+    finally:
+        store.close()
+    return status
+
+
+def _get_bulk_options(args, completers):
+    """return to dict of BULK_OPTIONS of args, with completers."""
+    options = dict((i, getattr(args, i)) for i in BULK_OPTIONS)
+    options['completers'] = completers
+    return options
+
+
+def _bulk_main(args, completers):
+    """generate completion files of commands into output directory."""
+    stats = [] if args.report else None
+    generators, status = _get_generators(args.commands, args.output_format,
+                                         completers, stats, args.cache_dir)
+    render_stats = None
+    if stats is not None:
+        render_stats = dict((i['name'], i) for i in stats)
+    options = _get_bulk_options(args, completers)
+    report = write_bulk(generators, args.output_dir, options,
+                        prune=args.prune, stats=render_stats)
+    write_manifest(args.output_dir, options, args.commands, report['files'],
+                   prune=args.prune)
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as fobj:
+            json.dump(get_resource_report(stats), fobj, indent=1,
+                      sort_keys=True)
+            fobj.write("\n")
+    return status
+
+
+class CompletionStore(object):
+
+    """SQLite database of option tables, shared by many users and shells.
+
+    ``options`` table has command, option, description, kind ('flag',
+    'choices' or value kind) and generated (unix time) columns, and is
+    indexed by (command, option).
+    """
+
+    SCHEMA = """\
+CREATE TABLE IF NOT EXISTS options (
+    command TEXT NOT NULL,
+    option TEXT NOT NULL,
+    description TEXT,
+    kind TEXT,
+    generated REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS options_command_option
+    ON options (command, option);
+"""
+
+    def __init__(self, path, timeout=10.0, readonly=False):
+        """
+        :param readonly: open existing database for query only, the file
+                         and schema are not created
+        :raise IOError: when database does not exist with ``readonly``
+        """
+        try:
+            import sqlite3
+        except ImportError:
+            raise ImportError("sqlite3 is required for CompletionStore")
+        if not readonly:
+            self.conn = sqlite3.connect(path, timeout=timeout)
+            self.conn.executescript(self.SCHEMA)
+            return
+        if not os.path.isfile(path):
+            raise IOError(errno.ENOENT, "completion store not found", path)
+        try:
+            from urllib.request import pathname2url
+        except ImportError:
+            from urllib import pathname2url
+        uri = "file:%s?mode=ro" % pathname2url(os.path.abspath(path))
+        self.conn = sqlite3.connect(uri, timeout=timeout, uri=True)
+
+    def update(self, compobj):
+        """replace options of command with option table of generator."""
+        rows = []
+        generated = time.time()
+        for entry in compobj.option_table:
+            if not entry['takes_value'] and not entry['metavar']:
+                kind = 'flag'
+            elif entry['choices'] and \
+                    get_user_value_kind(entry, compobj.completers) is None:
+                kind = 'choices'
+            else:
+                kind = get_value_kind(entry, compobj.completers)
+            for opt in entry['options']:
+                rows.append((compobj.commandname, opt, entry['help'], kind,
+                             generated))
+        with self.conn:
+            self.conn.execute("DELETE FROM options WHERE command = ?",
+                              (compobj.commandname,))
+            self.conn.executemany("INSERT OR REPLACE INTO options VALUES "
+                                  "(?, ?, ?, ?, ?)", rows)
+
+    def query(self, command, prefix=None):
+        """return to list of (option, description) of command.
+
+        :param prefix: return only options which start with it
+        """
+        sql = "SELECT option, description FROM options WHERE command = ?"
+        params = [command]
+        if prefix:
+            # range condition, which uses index unlike LIKE
+            sql += " AND option >= ? AND option < ?"
+            params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        return self.conn.execute(sql + " ORDER BY rowid", params).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def query_main(argv):
+    """``genzshcomp query`` main, print options in list format."""
+    oparser = ArgumentParser(prog='genzshcomp query',
+                             description='print options of command in '
+                                         'completion store')
+    oparser.add_argument('--db', required=True,
+                         help='SQLite database file of completion store')
+    oparser.add_argument('command', help='command name')
+    oparser.add_argument('prefix', nargs='?', help='prefix of options')
+    args = oparser.parse_args(argv)
+    import sqlite3
+    try:
+        store = CompletionStore(args.db, readonly=True)
+        try:
+            rows = store.query(args.command, args.prefix)
+        finally:
+            store.close()
+    except (IOError, OSError, sqlite3.Error) as exc:
+        sys.stderr.write("genzshcomp: %s: %s\n" % (args.db, exc))
+        return 1
+    for opt, description in rows:
+        if description:
+            print("%s:%s" % (opt, description))
+        else:
+            print(opt)
+    return 0
+
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+
+
+class InotifyWatcher(object):
+
+    """minimal inotify(7) binding with ctypes, for Linux."""
+
+    def __init__(self):
+        # imported here, not to slow down import of genzshcomp
+        import ctypes
+        import ctypes.util
+        import struct
+        self._event = struct.Struct('iIII')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.paths = {}
+
+    def add_watch(self, path,
+                  mask=IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+        """watch directory, return to watch descriptor or -1."""
+        wd = self._libc.inotify_add_watch(self.fd, path.encode('utf-8'),
+                                          mask)
+        if wd >= 0:
+            self.paths[wd] = path
+        return wd
+
+    def read_events(self, timeout=None):
+        """wait events, return to list of (directory, filename).
+
+        :param timeout: seconds to wait, or None to wait forever
+        :return: empty list at timeout
+        """
+        import select
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 65536)
+        ret = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self._event.unpack_from(data, offset)
+            offset += self._event.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd in self.paths and name:
+                ret.append((self.paths[wd], name.decode('utf-8', 'replace')))
+        return ret
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watch_dirs():
+    """return to directories of $PATH and virtualenv's bin."""
+    dirs = os.environ.get('PATH', '').split(os.pathsep)
+    if os.environ.get('VIRTUAL_ENV'):
+        dirs.append(os.path.join(os.environ['VIRTUAL_ENV'], 'bin'))
+    ret = []
+    for path in dirs:
+        path = os.path.abspath(path)
+        if os.path.isdir(path) and path not in ret:
+            ret.append(path)
+    return ret
+
+
+def _get_watch_targets(commands):
+    """return to dict of {(directory, filename): [commands]} of files of
+    commands (see :func:`get_command_files`). commands which are not found
+    are keyed by (None, name of command), to match the name in any
+    directory."""
+    ret = {}
+    for command in commands:
+        files = get_command_files(command)
+        keys = [os.path.split(i) for i in files] or \
+            [(None, os.path.basename(command.split()[0]))]
+        for key in keys:
+            ret.setdefault(key, []).append(command)
+    return ret
+
+
+def watch(commands, output_dir, options=None, watch_dirs=None,
+          debounce=2.0):
+    """regenerate completion files of commands, when they are changed.
+
+    watches directories of ``watch_dirs`` (default: $PATH) and of files
+    of commands, e.g. 'tool.py' of 'python tool.py' or a command given by
+    absolute path outside $PATH. blocks in select(2) while nothing is
+    changed. after a change, waits until no event comes for ``debounce``
+    seconds, then regenerates only changed commands. files of ``bundle``
+    and ``dedup`` options are shared by commands, so all commands are
+    regenerated for them.
+
+    :param options: dict of BULK_OPTIONS and completers, as stored in
+                    manifest (default: zsh format)
+    """
+    options = options or {'output_format': 'zsh'}
+    watcher = InotifyWatcher()
+    try:
+        dirs = list(watch_dirs or get_watch_dirs())
+        while True:
+            targets = _get_watch_targets(commands)
+            for path in dirs + [i[0] for i in targets if i[0]]:
+                if path not in watcher.paths.values():
+                    watcher.add_watch(path)
+            changed = set()
+            events = watcher.read_events()
+            while events:
+                changed.update(events)
+                events = watcher.read_events(debounce)
+            names = set(name for _, name in changed)
+            updated = set()
+            for (path, name), cmds in targets.items():
+                if (path, name) in changed or \
+                        (path is None and name in names):
+                    updated.update(cmds)
+            if not updated:
+                continue
+            updated = [i for i in commands if i in updated]
+            if options.get('bundle') or options.get('dedup'):
+                updated = commands
+            generators, _ = _get_generators(
+                updated, options['output_format'], options.get('completers'),
+                cache_dir=options.get('cache_dir'))
+            report = write_bulk(generators, output_dir, options)
+            manifest = read_manifest(output_dir)
+            if manifest is not None:
+                write_manifest(output_dir, options, manifest['commands'],
+                               report['files'])
+            print_report(report)
+            sys.stdout.flush()
+    finally:
+        watcher.close()
+
+
+def get_telemetry_log():
+    """return to default log file of --telemetry."""
+    state_dir = os.environ.get('XDG_STATE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.environ.get('GENZSHCOMP_TELEMETRY_LOG') or \
+        os.path.join(state_dir, 'genzshcomp', 'latency.log')
+
+
+def read_telemetry(fobj):
+    """return to list of (unix time, shell, command, phase, microseconds)
+    from log of --telemetry. broken lines are skipped."""
+    ret = []
+    for line in fobj:
+        fields = line.split()
+        if len(fields) != 5:
+            continue
+        try:
+            ret.append((int(fields[0]), fields[1], fields[2], fields[3],
+                        int(fields[4])))
+        except ValueError:
+            continue
+    return ret
+
+
+def get_latency_stats(records):
+    """return to list of dict of latency percentiles (microseconds) of
+    each (command, shell, phase), the slowest (p90) first."""
+    groups = {}
+    for _, shell, command, phase, usec in records:
+        groups.setdefault((command, shell, phase), []).append(usec)
+    ret = []
+    for (command, shell, phase), values in groups.items():
+        values.sort()
+        ret.append({'command': command, 'shell': shell, 'phase': phase,
+                    'count': len(values), 'p50': _percentile(values, 50),
+                    'p90': _percentile(values, 90),
+                    'p99': _percentile(values, 99), 'max': values[-1]})
+    ret.sort(key=lambda i: (-i['p90'], i['command']))
+    return ret
+
+
+def stats_main(argv):
+    """``genzshcomp stats`` main"""
+    oparser = ArgumentParser(prog='genzshcomp stats',
+                             description='latency percentiles of completion '
+                                         'functions from log of --telemetry')
+    oparser.add_argument('--json', action='store_true',
+                         help='print in JSON format')
+    oparser.add_argument('log', nargs='?', metavar='LOG',
+                         help='log file (default: $GENZSHCOMP_TELEMETRY_LOG '
+                              'or $XDG_STATE_HOME/genzshcomp/latency.log)')
+    args = oparser.parse_args(argv)
+    path = args.log or get_telemetry_log()
+    try:
+        with open(path) as fobj:
+            records = read_telemetry(fobj)
+    except (IOError, OSError) as exc:
+        sys.stderr.write("genzshcomp: %s\n" % exc)
+        return 1
+    stats = get_latency_stats(records)
+    if args.json:
+        print(json.dumps(stats, indent=1, sort_keys=True))
+        return 0
+    print("%-20s %-6s %-10s %6s %9s %9s %9s %9s" % (
+        'COMMAND', 'SHELL', 'PHASE', 'COUNT', 'P50(ms)', 'P90(ms)',
+        'P99(ms)', 'MAX(ms)'))
+    for i in stats:
+        print("%-20s %-6s %-10s %6d %9.1f %9.1f %9.1f %9.1f" % (
+            i['command'], i['shell'], i['phase'], i['count'],
+            i['p50'] / 1000.0, i['p90'] / 1000.0, i['p99'] / 1000.0,
+            i['max'] / 1000.0))
+    return 0
+
+
+def watch_main(argv):
+    """``genzshcomp watch`` main"""
+    oparser = ArgumentParser(prog='genzshcomp watch',
+                             description='regenerate completion files, '
+                                         'when commands are updated')
+    oparser.add_argument('-o', '--output-dir', required=True,
+                         help='directory of completion files')
+    oparser.add_argument("-f", "--output-format",
+                         help="output format type [zsh|bash] "
+                              "(default: format in manifest, or zsh)")
+    oparser.add_argument('-w', '--watch-dir', action='append',
+                         help='directory to watch (default: $PATH and '
+                              '$VIRTUAL_ENV/bin)')
+    oparser.add_argument('--debounce', type=float, default=2.0,
+                         help='seconds to wait for end of changes '
+                              '(default: 2.0)')
+    oparser.add_argument('commands', nargs='*', metavar='COMMAND',
+                         help='commands to watch (default: commands in '
+                              'manifest of output directory)')
+    args = oparser.parse_args(argv)
+    try:
+        manifest = read_manifest(args.output_dir)
+    except (IOError, OSError, ValueError) as exc:
+        oparser.error("%s: %s" % (args.output_dir, exc))
+    if manifest is None:
+        # files are regenerated in plain format, which may differ from
+        # the existing ones
+        if not args.commands:
+            oparser.error("no manifest in %s, generate it in bulk mode "
+                          "or give COMMANDs" % args.output_dir)
+        options = {'output_format': args.output_format or 'zsh'}
+        commands = args.commands
+    else:
+        options = manifest['options']
+        if args.output_format not in (None, options['output_format']):
+            oparser.error("%s is generated with -f %s" %
+                          (args.output_dir, options['output_format']))
+        if args.commands and (options.get('bundle') or options.get('dedup')):
+            oparser.error("COMMANDs can not be given for output directory "
+                          "of --bundle or --dedup")
+        commands = args.commands or manifest['commands']
+    if not commands:
+        oparser.error("no commands to watch")
+    try:
+        watch(commands, args.output_dir, options, args.watch_dir,
+              args.debounce)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
 def main():
     """tool main"""
-    oparser = ArgumentParser(version=__version__,
-                           description=__doc__,
-                           usage=USAGE_DOCS)
+    if sys.argv[1:2] == ['watch']:
+        return watch_main(sys.argv[2:])
+    if sys.argv[1:2] == ['query']:
+        return query_main(sys.argv[2:])
+    if sys.argv[1:2] == ['stats']:
+        return stats_main(sys.argv[2:])
+    oparser = ArgumentParser(description=__doc__,
+                             usage=USAGE_DOCS)
+    oparser.add_argument('--version', action='version', version=__version__)
     oparser.add_argument("-f", "--output-format", dest="output_format",
-                       help="output format type [zsh|bash|list] (default: zsh)")
+                       help="output format type "
+                            "[zsh|zsh_large|bash|list|json] "
+                            "(default: zsh)")
     oparser.add_argument("-n", "--command-name", help='override command name')
+    oparser.add_argument('--telemetry', action='store_true',
+                         help='log latency of generated functions, for '
+                              "'genzshcomp stats' (zsh, zsh_large and bash "
+                              'format)')
+    oparser.add_argument("--completer", action='append', default=[],
+                         metavar='OPTION=KIND',
+                         help='value completer of option or metavar, KIND is '
+                              'one of file, dir, number, host, url, user, '
+                              'none or zsh action')
 
     help_text_group = oparser.add_mutually_exclusive_group()
     help_text_group.add_argument('-c', '--command', help='command to execute to get --help')
     help_text_group.add_argument('-t', '--help-text', dest='help_text_file',
                                  help='file with output of --help')
+    help_text_group.add_argument('-s', '--source', metavar='FILE',
+                                 help='Python script to read parser from, '
+                                      'without executing it')
+    help_text_group.add_argument('--from-json', metavar='FILE',
+                                 help="file with output of '-f json' "
+                                      "('-' for stdin)")
+    oparser.add_argument('--subcommands', action='store_true',
+                         help='follow subcommands of --command recursively '
+                              '(zsh format)')
+    oparser.add_argument('--max-depth', type=int, default=2,
+                         help='max depth of --subcommands (default: 2)')
+    oparser.add_argument('-j', '--jobs', type=int, default=8,
+                         help='parallel help commands of --subcommands '
+                              '(default: 8)')
+    oparser.add_argument('-o', '--output-dir',
+                         help='directory to write completion files of '
+                              'COMMANDs')
+    oparser.add_argument('--db',
+                         help='SQLite database file to store options of '
+                              'COMMANDs')
+    oparser.add_argument('--install', action='store_true',
+                         help="write bash format to bash-completion's "
+                              "on-demand completions directory")
+    oparser.add_argument('--dedup', action='store_true',
+                         help='write one shared zsh function for commands '
+                              'with identical options')
+    oparser.add_argument('--bundle', metavar='FILENAME',
+                         help='write all zsh functions and compdef to one '
+                              'bundle file in output directory')
+    oparser.add_argument('--lazy', action='store_true',
+                         help='write small stubs to bundle file, which '
+                              'load option specs at first completion')
+    oparser.add_argument('--prune', action='store_true',
+                         help='remove files in output directory written '
+                              'by genzshcomp for other commands')
+    oparser.add_argument('--zcompile', action='store_true',
+                         help='compile written files with zcompile')
+    oparser.add_argument('--cache-dir', metavar='DIR',
+                         help='cache option tables of COMMANDs, until they '
+                              'are updated')
+    oparser.add_argument('--report', metavar='FILE',
+                         help='write costs of each COMMAND and summary '
+                              'in JSON format')
+    oparser.add_argument('commands', nargs='*', metavar='COMMAND',
+                         help='commands to generate completion (bulk mode)')
     args = oparser.parse_args()
+    for completer in args.completer:
+        if '=' not in completer:
+            oparser.error("--completer: %r is not OPTION=KIND" % completer)
+    completers = dict(i.split('=', 1) for i in args.completer)
+    if args.telemetry:
+        if args.output_format not in (None, 'zsh', 'zsh_large', 'bash'):
+            oparser.error("--telemetry is for zsh, zsh_large and bash format")
+        if args.lazy or args.subcommands:
+            oparser.error("--telemetry is not for --lazy and --subcommands")
+    if args.commands:
+        if args.output_format is None:
+            args.output_format = 'zsh'
+        if args.install:
+            if args.output_format != 'bash' or args.output_dir:
+                oparser.error("--install is for bash format, without "
+                              "--output-dir")
+            args.output_dir = get_bash_completion_dir()
+        if args.db:
+            return _store_main(args, completers)
+        if args.output_dir is None:
+            oparser.error("--output-dir or --db is required with COMMAND")
+        if (args.bundle or args.zcompile) and \
+                args.output_format not in ('zsh', 'zsh_large'):
+            oparser.error("--bundle and --zcompile are for zsh and "
+                          "zsh_large format")
+        if args.lazy and args.output_format != 'zsh':
+            oparser.error("--lazy is for zsh format")
+        if args.lazy and not args.bundle:
+            oparser.error("--lazy is for --bundle")
+        return _bulk_main(args, completers)
+    if args.from_json is not None:
+        if args.from_json == '-':
+            data = sys.stdin.read()
+        else:
+            with open(args.from_json) as fobj:
+                data = fobj.read()
+        compobj = load_json(data, output_format=args.output_format,
+                            completers=completers)
+        compobj.telemetry = args.telemetry
+        if args.command_name is not None:
+            compobj.commandname = args.command_name
+        print(compobj.get())
+        return 0
+    if args.source is not None:
+        with open(args.source) as fobj:
+            source_parser = SourceParser(fobj.read(), args.source)
+        command_name = args.command_name or source_parser.get_commandname()
+        if command_name is None:
+            command_name = os.path.splitext(os.path.basename(args.source))[0]
+        compobj = CompletionGenerator(command_name,
+                                      source_parser.source2parseobj(),
+                                      output_format=args.output_format,
+                                      completers=completers,
+                                      telemetry=args.telemetry)
+        print(compobj.get())
+        return 0
+    if args.subcommands:
+        if args.command is None:
+            oparser.error("--subcommands requires --command")
+        if args.output_format not in (None, 'zsh'):
+            oparser.error("--subcommands is for zsh format")
+        tree = discover_subcommands(args.command, args.max_depth, args.jobs)
+        if args.command_name is not None:
+            tree['name'] = args.command_name
+        print(generate_zsh_tree(tree, completers))
+        return 0
     if args.command is not None:
-        cmd = args.command.strip()
-        if not (cmd.endswith(' --help') or cmd.endswith(' -h')):
-            cmd += ' --help'
-        helptext = subprocess.check_output(cmd, shell=True)
+        helptext = get_help_text(args.command)
     elif args.help_text_file is not None:
         helptext = open(args.help_text_file).read()
     elif sys.stdin.isatty():
@@ -496,7 +2725,9 @@ def main():
                     help_parser.get_commandname())
     option_parser = help_parser.help2parseobj()
     compobj = CompletionGenerator(command_name, option_parser,
-                                  output_format=args.output_format)
+                                  output_format=args.output_format,
+                                  completers=completers,
+                                  telemetry=args.telemetry)
     print(compobj.get())
     return 0
 
@@ -0,0 +1,57 @@
+#!/bin/sh
+# compare per-TAB latency of zsh and zsh_large formats.
+# 'bench' has NUM options: 10 of '--x*' and NUM-10 of '--o*'. completion of
+# '--x' has 10 matches whatever NUM is, and '--o' has NUM-10 matches.
+#   usage: sh test/bench_large.sh [NUM ...]
+GENZSH_BIN="python ./genzshcomp.py"
+command -v zsh > /dev/null || { echo "zsh is required" >&2; exit 1; }
+RUNS=${RUNS:-20}
+WORKDIR=`mktemp -d`
+trap 'rm -rf $WORKDIR' EXIT
+[ $# -eq 0 ] && set -- 100 500 2000
+
+tab() {
+    # print median of microseconds of completion function, $RUNS TABs
+    zsh -f -c '
+    zmodload zsh/zpty
+    zpty -b z zsh -f -i
+    zpty -w z "PS1=; unsetopt auto_list auto_menu beep; zmodload zsh/datetime"
+    zpty -w z "fpath=($1 \$fpath); autoload -Uz compinit; compinit -D -u"
+    zpty -w z "_bench_timed() { local t=\$EPOCHREALTIME; _bench \"\$@\";" \
+        "print -r -- \$(( (EPOCHREALTIME - t) * 1000000 )) >> $1/times }"
+    zpty -w z "compdef _bench_timed bench"
+    repeat $(( $3 + 1 )); do
+        zpty -w -n z "bench $2"$'"'"'\t\x15'"'"'
+    done
+    zpty -w z "print BENCH_\"\"DONE"
+    zpty -r z line "*BENCH_DONE*" || exit 1
+    zpty -d z
+    times=(${${(f)"$(<$1/times)"}%.*})
+    shift times    # first TAB loads completion function
+    times=(${(n)times})
+    print $times[$(( ($#times + 1) / 2 ))]
+    ' zsh "$1" "$2" "$3"
+    rm -f "$1/times"
+}
+
+for num in "$@"
+do
+    python - $num > $WORKDIR/bench.json <<EOF
+import json, sys
+num = int(sys.argv[1])
+opts = ['--x%d' % i for i in range(10)]
+opts += ['--o%d' % i for i in range(num - 10)]
+print(json.dumps({'version': 1, 'command': 'bench', 'options': [
+    {'options': [opt], 'help': 'help of %s' % opt} for opt in opts]}))
+EOF
+    for format in zsh zsh_large
+    do
+        mkdir -p $WORKDIR/$format
+        $GENZSH_BIN -f $format --from-json $WORKDIR/bench.json \
+            > $WORKDIR/$format/_bench || exit 1
+        echo "$format options=$num" \
+            "'--x'(10 matches): `tab $WORKDIR/$format --x $RUNS` us" \
+            "'--o'(`expr $num - 10` matches):" \
+            "`tab $WORKDIR/$format --o $RUNS` us"
+    done
+done
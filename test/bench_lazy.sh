@@ -0,0 +1,59 @@
+#!/bin/sh
+# compare bundle file with and without --lazy: startup time, memory of idle
+# shell, and time of the first TAB of COMMAND (median of $RUNS shells).
+#   usage: sh test/bench_lazy.sh COMMAND [COMMAND ...]
+GENZSH_BIN="python ./genzshcomp.py"
+command -v zsh > /dev/null || { echo "zsh is required" >&2; exit 1; }
+RUNS=${RUNS:-20}
+WORKDIR=`mktemp -d`
+trap 'rm -rf $WORKDIR' EXIT
+
+$GENZSH_BIN -o $WORKDIR/bundle --bundle comp.zsh "$@" || exit 1
+$GENZSH_BIN -o $WORKDIR/lazy --bundle comp.zsh --lazy "$@" || exit 1
+SETUP="autoload -Uz compinit; compinit -D -u; source"
+
+startup() {
+    start=`date +%s%N`
+    i=0
+    while [ $i -lt $RUNS ]
+    do
+        zsh -f -c "$SETUP $1/comp.zsh" || exit 1
+        i=`expr $i + 1`
+    done
+    end=`date +%s%N`
+    expr \( $end - $start \) / $RUNS / 1000
+}
+
+idle_rss() {
+    zsh -f -c "$SETUP $1/comp.zsh; ps -o rss= -p \$\$"
+}
+
+first_tab() {
+    # print median of microseconds of the first completion of COMMAND
+    zsh -f -c '
+    zmodload zsh/zpty
+    repeat $4; do
+        zpty -b z zsh -f -i
+        zpty -w z "PS1=; unsetopt auto_list auto_menu beep; zmodload zsh/datetime"
+        zpty -w z "$3 $1/comp.zsh; _bench_func=\$_comps[$2]"
+        zpty -w z "_bench_timed() { local t=\$EPOCHREALTIME;" \
+            "\$_bench_func \"\$@\";" \
+            "print -r -- \$(( (EPOCHREALTIME - t) * 1000000 )) >> $1/times }"
+        zpty -w z "compdef _bench_timed $2"
+        zpty -w -n z "$2 --"$'"'"'\t\x15'"'"'
+        zpty -w z "print BENCH_\"\"DONE"
+        zpty -r z line "*BENCH_DONE*" || exit 1
+        zpty -d z
+    done
+    times=(${(n)${${(f)"$(<$1/times)"}%.*}})
+    print $times[$(( ($#times + 1) / 2 ))]
+    ' zsh "$1" "$2" "$SETUP" "$RUNS"
+    rm -f "$1/times"
+}
+
+for mode in bundle lazy
+do
+    echo "$mode: startup `startup $WORKDIR/$mode` us," \
+        "idle rss `idle_rss $WORKDIR/$mode` KB," \
+        "first TAB of $1 `first_tab $WORKDIR/$mode $1` us"
+done
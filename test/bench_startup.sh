@@ -0,0 +1,29 @@
+#!/bin/sh
+# compare zsh startup time, completion files on fpath vs. bundle file.
+#   usage: sh test/bench_startup.sh COMMAND [COMMAND ...]
+GENZSH_BIN="python ./genzshcomp.py"
+command -v zsh > /dev/null || { echo "zsh is required" >&2; exit 1; }
+RUNS=${RUNS:-20}
+WORKDIR=`mktemp -d`
+trap 'rm -rf $WORKDIR' EXIT
+
+$GENZSH_BIN -o $WORKDIR/fpath "$@" || exit 1
+$GENZSH_BIN -o $WORKDIR/bundle --bundle comp.zsh "$@" || exit 1
+$GENZSH_BIN -o $WORKDIR/zwc --bundle comp.zsh --zcompile "$@" || exit 1
+
+bench() {
+    start=`date +%s%N`
+    i=0
+    while [ $i -lt $RUNS ]
+    do
+        zsh -f -c "$2" || exit 1
+        i=`expr $i + 1`
+    done
+    end=`date +%s%N`
+    echo "$1: `expr \( $end - $start \) / $RUNS / 1000` us"
+}
+
+# -D: rebuild without dump file, as after completion files are changed
+bench "fpath " "fpath=($WORKDIR/fpath \$fpath); autoload -Uz compinit; compinit -D -u"
+bench "bundle" "autoload -Uz compinit; compinit -D -u; source $WORKDIR/bundle/comp.zsh"
+bench "zwc   " "autoload -Uz compinit; compinit -D -u; source $WORKDIR/zwc/comp.zsh"
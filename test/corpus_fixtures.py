@@ -0,0 +1,55 @@
+"""optparse parsers of commands in corpus, which are not in the standard
+library (options of their old versions, as in test_genzshcomp.py).
+
+    python test/corpus_runner.py --capture corpus_fixtures:virtualenv \
+        --name virtualenv
+"""
+from optparse import OptionParser
+
+
+def virtualenv():
+    parser = OptionParser(usage="%prog [OPTIONS] DEST_DIR",
+                          version="1.5.1", prog="virtualenv")
+    parser.add_option("-v", "--verbose", action="count", default=0,
+                      help="Increase verbosity")
+    parser.add_option("-q", "--quiet", action="count", default=0,
+                      help="Decrease verbosity")
+    parser.add_option("-p", "--python", metavar="PYTHON_EXE",
+                      help="The Python interpreter to use, e.g., "
+                           "--python=python2.5 will use the python2.5 "
+                           "interpreter to create the new environment.")
+    parser.add_option("--clear", action="store_true",
+                      help="Clear out the non-root install and start from "
+                           "scratch")
+    parser.add_option("--no-site-packages", action="store_true",
+                      help="Don't give access to the global site-packages "
+                           "dir to the virtual environment")
+    parser.parse_args()
+
+
+def nosetests():
+    parser = OptionParser(usage="%prog [options]", prog="nosetests")
+    parser.add_option("-V", "--version", action="store_true",
+                      help="Output nose version and exit")
+    parser.add_option("-p", "--plugins", action="store_true",
+                      help="Output list of available plugins and exit. "
+                           "Combine with higher verbosity for greater detail")
+    parser.add_option("-v", "--verbose", action="count",
+                      help="Be more verbose. [NOSE_VERBOSE]")
+    parser.add_option("--verbosity", type="int",
+                      help="Set verbosity; --verbosity=2 is the same as -v")
+    parser.add_option("-q", "--quiet", action="store_const", const=0,
+                      dest="verbosity", help="Be less verbose")
+    parser.add_option("-c", "--config", action="append", metavar="FILES",
+                      help="Load configuration from config file(s). May be "
+                           "specified multiple times")
+    parser.add_option("-w", "--where", action="append",
+                      help="Look for tests in this directory. [NOSE_WHERE]")
+    parser.add_option("-m", "--match", "--testmatch", metavar="REGEX",
+                      help="Files, directories, function names, and class "
+                           "names that match this regular expression are "
+                           "considered tests. [NOSE_TESTMATCH]")
+    parser.add_option("--exe", action="store_true",
+                      help="Look for tests in python modules that are "
+                           "executable.")
+    parser.parse_args()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""golden corpus runner of HelpParser.
+
+corpus/<case>.help is output of ``--help`` and corpus/<case>.json is
+expected option table, which is taken from the real parser object.
+corpus/baseline.json records which cases are parsed correctly and parse
+throughput of each backend (help2optparse, help2argparse), relative to a
+calibration loop over the same help strings in the same run, so that it
+does not depend on speed of the machine.
+
+argparse cases are also captured as <case>-py39, with the section title
+of Python < 3.10 ('optional arguments:'). they differ only in the title,
+and do not cover other changes of argparse's format between versions
+(e.g. '-o, --output OUTPUT' of Python 3.13 instead of
+'-o OUTPUT, --output OUTPUT'), which need help strings captured with
+those versions. optparse cases of commands outside the standard library
+are captured from corpus_fixtures.py.
+
+usage:
+    python test/corpus_runner.py                  # check with baseline
+    python test/corpus_runner.py --save-baseline  # update baseline
+    python test/corpus_runner.py --capture MODULE [--name NAME]
+"""
+import json
+import os
+import re
+import runpy
+import sys
+import time
+from argparse import ArgumentParser
+from optparse import OptionParser
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.split(TEST_DIR)[0])
+import genzshcomp
+
+CORPUS_DIR = os.path.join(TEST_DIR, 'corpus')
+BASELINE_FILE = os.path.join(CORPUS_DIR, 'baseline.json')
+CORPUS_VERSION = 1
+
+
+def get_cases():
+    """return to sorted list of case names."""
+    return sorted(i[:-5] for i in os.listdir(CORPUS_DIR)
+                  if i.endswith('.help'))
+
+
+def load_case(name):
+    """return to (help strings, expected data) of case."""
+    with open(os.path.join(CORPUS_DIR, name + '.help')) as fobj:
+        helptext = fobj.read()
+    with open(os.path.join(CORPUS_DIR, name + '.json')) as fobj:
+        expected = json.load(fobj)
+    return helptext, expected
+
+
+def _normalize(table):
+    """option table to comparable form: set of (options, takes_value)."""
+    return sorted((sorted(i['options']), bool(i['takes_value']))
+                  for i in table)
+
+
+def parse_case(helptext):
+    """return to (backend name, option table) of help strings.
+
+    :raise Exception: when HelpParser fails
+    """
+    hp = genzshcomp.HelpParser(helptext)
+    parser = hp.help2parseobj()
+    backend = 'help2%s' % hp.parser_type
+    return backend, genzshcomp.get_option_table(parser)
+
+
+def check_case(name):
+    """return to (backend, ok, message) of case."""
+    helptext, expected = load_case(name)
+    try:
+        backend, table = parse_case(helptext)
+    except Exception as exc:
+        return 'help2%s' % expected['parser_type'], False, repr(exc)
+    got = _normalize(table)
+    want = _normalize(expected['options'])
+    if got == want:
+        return backend, True, ''
+    missing = [i for i in want if i not in got]
+    extra = [i for i in got if i not in want]
+    return backend, False, 'missing=%s extra=%s' % (missing, extra)
+
+
+_CALIBRATION_RE = re.compile(r"(-{1,2}[\w-]+)(?:[ =]([\w{},.-]+))?")
+
+
+def _calibrate(helptext):
+    """plain tokenizing of help strings, as speed reference of machine."""
+    for line in helptext.splitlines():
+        line.split()
+        _CALIBRATION_RE.findall(line)
+
+
+def _time_pass(func, helptexts):
+    """return to seconds of one pass of func over helptexts."""
+    start = time.time()
+    for helptext in helptexts:
+        func(helptext)
+    return time.time() - start
+
+
+def measure_throughput(names, min_time=0.5):
+    """return to {backend: (help bytes parsed per second, relative to
+    calibration)} of cases in names.
+
+    names should be cases parsed correctly, so that time of failing
+    parses is not counted. passes of parsing and calibration are
+    interleaved for ``min_time`` seconds, and the fastest pass of each is
+    used, which is less affected by other processes than the average.
+    """
+    groups = {}
+    for name in names:
+        helptext, expected = load_case(name)
+        groups.setdefault('help2%s' % expected['parser_type'],
+                          []).append(helptext)
+    ret = {}
+    for backend, helptexts in sorted(groups.items()):
+        size = sum(len(i) for i in helptexts)
+        calibration = parse = None
+        deadline = time.time() + min_time
+        while time.time() < deadline or calibration is None:
+            elapsed = _time_pass(_calibrate, helptexts)
+            calibration = min(calibration or elapsed, elapsed)
+            elapsed = _time_pass(parse_case, helptexts)
+            parse = min(parse or elapsed, elapsed)
+        ret[backend] = (size / parse, calibration / parse)
+    return ret
+
+
+class _Captured(Exception):
+
+    def __init__(self, parser):
+        Exception.__init__(self)
+        self.parser = parser
+
+
+def capture(target, name=None):
+    """run module or 'module:function' until it parses arguments, and
+    write help strings and option table of its parser to corpus.
+
+    argparse parsers are also written with the title of Python < 3.10
+    ('optional arguments:') as <name>-py39.
+    """
+    def hook(self, *args, **kwargs):
+        raise _Captured(self)
+
+    saved = (ArgumentParser.parse_known_args, OptionParser.parse_args,
+             sys.argv)
+    ArgumentParser.parse_known_args = hook
+    OptionParser.parse_args = hook
+    sys.argv = [target, '--help']
+    os.environ['COLUMNS'] = '80'
+    try:
+        if ':' in target:
+            genzshcomp._load_factory(target)()
+        else:
+            runpy.run_module(target, run_name='__main__', alter_sys=True)
+    except _Captured as exc:
+        parser = exc.parser
+    else:
+        raise RuntimeError("%s does not parse arguments" % target)
+    finally:
+        (ArgumentParser.parse_known_args, OptionParser.parse_args,
+         sys.argv) = saved
+
+    name = name or target.replace(':', '.')
+    parser_type = genzshcomp.get_parser_type(parser)
+    variants = [(name, parser.format_help())]
+    if parser_type == 'argparse':
+        parser._optionals.title = 'optional arguments'
+        helptext = parser.format_help()
+        # e.g. parsers which have their own title of optional arguments
+        if helptext != variants[0][1]:
+            variants.append((name + '-py39', helptext))
+    table = [dict(options=i['options'], takes_value=i['takes_value'])
+             for i in genzshcomp.get_option_table(parser)]
+    for case, helptext in variants:
+        with open(os.path.join(CORPUS_DIR, case + '.help'), 'w') as fobj:
+            fobj.write(helptext)
+        with open(os.path.join(CORPUS_DIR, case + '.json'), 'w') as fobj:
+            json.dump({'version': CORPUS_VERSION, 'command': target,
+                       'parser_type': parser_type, 'options': table},
+                      fobj, indent=1, sort_keys=True)
+            fobj.write("\n")
+        print("captured: %s" % case)
+
+
+def main():
+    oparser = ArgumentParser(description=__doc__.splitlines()[0])
+    oparser.add_argument('--capture', metavar='MODULE',
+                         help="add module or 'module:function' to corpus")
+    oparser.add_argument('--name', help='case name of --capture')
+    oparser.add_argument('--save-baseline', action='store_true',
+                         help='record current results as baseline')
+    oparser.add_argument('--tolerance', type=float, default=0.25,
+                         help='allowed drop of relative throughput '
+                              '(default: 0.25)')
+    oparser.add_argument('--advisory', action='store_true',
+                         help='report throughput drop without failing')
+    args = oparser.parse_args()
+    if args.capture:
+        capture(args.capture, args.name)
+        return 0
+
+    names = get_cases()
+    results = {}
+    for name in names:
+        backend, ok, message = check_case(name)
+        results[name] = ok
+        print("%s %-28s %s %s" % ('OK' if ok else 'NG', name, backend,
+                                  message))
+    throughput = measure_throughput([i for i in names if results[i]])
+    for backend, (value, relative) in sorted(throughput.items()):
+        print("throughput %s: %.0f KB/s (%.3f of calibration)" % (
+            backend, value / 1024, relative))
+    print("%d/%d cases parsed correctly" % (sum(results.values()),
+                                            len(names)))
+
+    relatives = dict((i, j[1]) for i, j in throughput.items())
+    if args.save_baseline:
+        with open(BASELINE_FILE, 'w') as fobj:
+            json.dump({'version': CORPUS_VERSION, 'cases': results,
+                       'relative_throughput': relatives}, fobj, indent=1,
+                      sort_keys=True)
+            fobj.write("\n")
+        return 0
+
+    with open(BASELINE_FILE) as fobj:
+        baseline = json.load(fobj)
+    status = 0
+    for name, ok in sorted(baseline['cases'].items()):
+        if ok and not results.get(name):
+            print("REGRESSION: %s" % name)
+            status = 1
+    for backend, value in sorted(baseline['relative_throughput'].items()):
+        if backend not in relatives:
+            print("NOT MEASURED: %s has no correctly parsed case" % backend)
+            if not args.advisory:
+                status = 1
+        elif relatives[backend] < value * (1 - args.tolerance):
+            print("SLOWER: %s %.3f -> %.3f of calibration" % (
+                backend, value, relatives[backend]))
+            if not args.advisory:
+                status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
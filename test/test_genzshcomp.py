@@ -177,6 +177,26 @@ class TestHelpParser(TestCase):
         self.assertEqual(parser.has_option('-t'), False)
         self.assertEqual(parser.has_option('--text'), True)
 
+    def test_optparse_flag(self):
+        hp = genzshcomp.HelpParser("Options:")
+        optlist = [{'short': '-q', 'long': '--quiet',
+                    'metavar': None, 'help': "quiet"},
+                   {'short': '-f', 'long': '--file',
+                    'metavar': 'FILE', 'help': "file"}]
+        parser = hp._get_parserobj(optlist)
+        self.assertEqual(False, parser.get_option('-q').takes_value())
+        self.assertEqual(True, parser.get_option('-f').takes_value())
+
+    def test_parser_type_is_argparse_py310(self):
+        help_string = """\
+usage: dummy [-h]
+
+options:
+  -h, --help  show this help message and exit
+"""
+        hp = genzshcomp.HelpParser(help_string)
+        self.assertEqual('argparse', hp.parser_type)
+
     @available_argparse
     def test_parser_type_is_argparse(self):
         hp = genzshcomp.HelpParser("optional arguments:")
@@ -584,6 +604,58 @@ optional arguments:
         self.assertEqual(True, "verify" in args)
 
 
+class TestSourceParser(TestCase):
+
+    def test_argparse(self):
+        source = "\n".join([
+            "import argparse",
+            "import module_not_found",
+            "parser = argparse.ArgumentParser(prog='mytool')",
+            "parser.add_argument('-f', '--file', metavar='FILE', "
+            "help=_('a file'))",
+            "parser.add_argument('--level', type=int, choices=[1, 2])",
+            "parser.add_argument('--hidden', help=argparse.SUPPRESS)",
+            "parser.add_argument('--default', default=DEFAULT)",
+            "parser.add_argument(OPTION)",
+            "group = parser.add_mutually_exclusive_group()",
+            "group.add_argument('-q', '--quiet', action='store_true')",
+            "sub = parser.add_subparsers()",
+            "sub.add_parser('run').add_argument('--run-only')",
+            "raise SystemExit(1)"])
+        source_parser = genzshcomp.SourceParser(source)
+        self.assertEqual('argparse', source_parser.parser_type)
+        self.assertEqual('mytool', source_parser.get_commandname())
+        table = genzshcomp.get_option_table(source_parser.source2parseobj())
+        self.assertEqual([['-h', '--help'], ['-f', '--file'], ['--level'],
+                          ['--default'], ['-q', '--quiet']],
+                         [i['options'] for i in table])
+        self.assertEqual('a file', table[1]['help'])
+        self.assertEqual('int', table[2]['type'])
+        self.assertEqual(['1', '2'], table[2]['choices'])
+        self.assertEqual(False, table[4]['takes_value'])
+
+    def test_optparse(self):
+        source = "\n".join([
+            "from optparse import OptionParser, OptionGroup",
+            "def main():",
+            "    parser = OptionParser()",
+            "    parser.add_option('-v', action='store_true', help='verbose')",
+            "    group = OptionGroup(parser, 'debug')",
+            "    group.add_option('--trace', metavar='FILE')",
+            "    parser.add_option_group(group)"])
+        source_parser = genzshcomp.SourceParser(source)
+        self.assertEqual('optparse', source_parser.parser_type)
+        self.assertEqual(None, source_parser.get_commandname())
+        table = genzshcomp.get_option_table(source_parser.source2parseobj())
+        self.assertEqual([['--help', '-h'], ['-v'], ['--trace']],
+                         [i['options'] for i in table])
+        self.assertEqual('FILE', table[2]['metavar'])
+
+    def test_no_parser(self):
+        self.assertRaises(genzshcomp.InvalidParserTypeError,
+                          genzshcomp.SourceParser, "print('hello')")
+
+
 class TestGenList(TestCase):
 
     def test_own(self):
@@ -607,5 +679,1095 @@ Options:
         self.assertEqual(True, '--help:show' in zshlist)
 
 
+class TestGetCompletion(TestCase):
+
+    def setUp(self):
+        genzshcomp._completion_cache.clear()
+
+    def _get_parser(self):
+        parser = OptionParser()
+        parser.add_option("-f", "--file", metavar="FILE", help="input file")
+        return parser
+
+    def test_fingerprint_changes_with_help(self):
+        parser = self._get_parser()
+        gen = genzshcomp.CompletionGenerator('dummy', parser)
+        before = gen.fingerprint()
+        parser.add_option("-q", action="store_true", help="quiet")
+        gen = genzshcomp.CompletionGenerator('dummy', parser)
+        self.assertNotEqual(before, gen.fingerprint())
+
+    def test_fingerprint_changes_with_version(self):
+        gen = genzshcomp.CompletionGenerator('dummy', self._get_parser())
+        before = gen.fingerprint()
+        saved = genzshcomp.__version__
+        genzshcomp.__version__ = saved + '.dev'
+        try:
+            self.assertNotEqual(before, gen.fingerprint())
+        finally:
+            genzshcomp.__version__ = saved
+
+    def test_memoized(self):
+        parser = self._get_parser()
+        ret = genzshcomp.get_completion('dummy', parser)
+        self.assertEqual(
+            genzshcomp.CompletionGenerator('dummy', parser).get(), ret)
+        key = ('dummy', 'zsh')
+        self.assertEqual(True, key in genzshcomp._completion_cache)
+        genzshcomp._completion_cache[key] = (
+            genzshcomp._completion_cache[key][0], 'memoized')
+        self.assertEqual('memoized', genzshcomp.get_completion('dummy', parser))
+
+    def test_cache_dir(self):
+        import shutil
+        import tempfile
+        cache_dir = tempfile.mkdtemp()
+        try:
+            parser = self._get_parser()
+            ret = genzshcomp.get_completion('dummy', parser, 'bash',
+                                            cache_dir=cache_dir)
+            cache_file = os.path.join(cache_dir, 'dummy.bash.cache')
+            self.assertEqual(True, os.path.exists(cache_file))
+            self.assertEqual(['dummy.bash.cache'], os.listdir(cache_dir))
+            genzshcomp._completion_cache.clear()
+            self.assertEqual(ret, genzshcomp.get_completion(
+                'dummy', parser, 'bash', cache_dir=cache_dir))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_cache_dir_created(self):
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache_dir = os.path.join(tmpdir, 'cache', 'genzshcomp')
+            genzshcomp.get_completion('dummy', self._get_parser(), 'zsh',
+                                      cache_dir=cache_dir)
+            self.assertEqual(['dummy.zsh.cache'], os.listdir(cache_dir))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_cache_lock(self):
+        import shutil
+        import tempfile
+        cache_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(cache_dir, 'dummy.zsh.cache')
+            with genzshcomp.cache_lock(path) as locked:
+                self.assertEqual(True, locked)
+                with genzshcomp.cache_lock(path, timeout=0.1) as locked:
+                    self.assertEqual(False, locked)
+            with genzshcomp.cache_lock(path, timeout=0.1) as locked:
+                self.assertEqual(True, locked)
+            self.assertEqual([], os.listdir(cache_dir))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_cache_lock_removed(self):
+        import shutil
+        import tempfile
+        cache_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(cache_dir, 'dummy.zsh.cache')
+            # waiter has opened the lock file, which the holder removes
+            with open(path + '.lock', 'a') as stale:
+                with genzshcomp.cache_lock(path) as locked:
+                    self.assertEqual(True, locked)
+                self.assertEqual(False, os.path.exists(path + '.lock'))
+                self.assertEqual(False, genzshcomp._is_same_file(
+                    stale, path + '.lock'))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_cache_locked_by_other(self):
+        import shutil
+        import tempfile
+        cache_dir = tempfile.mkdtemp()
+        try:
+            parser = self._get_parser()
+            path = os.path.join(cache_dir, 'dummy.zsh.cache')
+            saved = genzshcomp.CACHE_LOCK_TIMEOUT
+            genzshcomp.CACHE_LOCK_TIMEOUT = 0.1
+            with genzshcomp.cache_lock(path):
+                ret = genzshcomp.get_completion('dummy', parser,
+                                                cache_dir=cache_dir)
+                self.assertEqual(
+                    genzshcomp.CompletionGenerator('dummy', parser).get(),
+                    ret)
+                self.assertEqual(False, os.path.exists(path))
+        finally:
+            genzshcomp.CACHE_LOCK_TIMEOUT = saved
+            shutil.rmtree(cache_dir)
+
+    def test_write_atomic(self):
+        import shutil
+        import tempfile
+        cache_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(cache_dir, 'dummy')
+            genzshcomp.write_atomic(path, 'old')
+            genzshcomp.write_atomic(path, 'new')
+            with open(path) as fobj:
+                self.assertEqual('new', fobj.read())
+            self.assertEqual(['dummy'], os.listdir(cache_dir))
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+class TestBuildCompletion(TestCase):
+
+    def test_data_files(self):
+        import shutil
+        import tempfile
+        from setuptools import Distribution
+        build_dir = tempfile.mkdtemp()
+        try:
+            dist = Distribution({'name': 'dummy',
+                                 'cmdclass': genzshcomp.get_cmdclass()})
+            cmd = dist.get_command_obj('build_completion')
+            cmd.completion_parsers = 'dummy = optparse:OptionParser'
+            cmd.build_dir = build_dir
+            cmd.ensure_finalized()
+            cmd.run()
+            zshfile = os.path.join(build_dir, 'zsh', '_dummy')
+            bashfile = os.path.join(build_dir, 'bash', 'dummy')
+            self.assertEqual(True, os.path.exists(zshfile))
+            self.assertEqual(True, os.path.exists(bashfile))
+            self.assertEqual(
+                [('share/bash-completion/completions', [bashfile]),
+                 ('share/zsh/site-functions', [zshfile])],
+                dist.data_files)
+        finally:
+            shutil.rmtree(build_dir)
+
+
+class TestInstall(TestCase):
+
+    def _run(self, parser, args):
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.assertRaises(SystemExit, parser.parse_args, args)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_optparse(self):
+        parser = OptionParser(prog='dummy')
+        parser.add_option("-q", action="store_true", help="quiet")
+        genzshcomp.install(parser)
+        ret = self._run(parser, ["--print-completion", "list"])
+        self.assertEqual("--help:show this help message and exit\n"
+                         "-h:show this help message and exit\n"
+                         "-q:quiet\n", ret)
+
+    @available_argparse
+    def test_argparse(self):
+        parser = argparse.ArgumentParser(prog='dummy')
+        parser.add_argument("-q", action="store_true", help="quiet")
+        genzshcomp.install(parser)
+        ret = self._run(parser, ["--print-completion", "zsh"])
+        self.assertEqual(True, ret.startswith("#compdef dummy\n"))
+        self.assertEqual(True, '"-q[quiet]"' in ret)
+        self.assertEqual(False, '--print-completion' in ret)
+        args = parser.parse_args(["-q"])
+        self.assertEqual(True, args.q)
+
+
+class TestValueCompleter(TestCase):
+
+    def _get_zsh(self, parser, completers=None):
+        return genzshcomp.CompletionGenerator('dummy', parser,
+                                              completers=completers).get()
+
+    def test_optparse_metavar(self):
+        parser = OptionParser()
+        parser.add_option("--workers", metavar="N", help="workers")
+        parser.add_option("--host", metavar="HOST", help="host")
+        parser.add_option("--log-dir", metavar="LOG_DIR", help="log dir")
+        parser.add_option("--conf", metavar="CONF", help="config")
+        zsh = self._get_zsh(parser)
+        self.assertEqual(True, '"--workers[workers]::N: "' in zsh)
+        self.assertEqual(True, '"--host[host]::HOST:_hosts"' in zsh)
+        self.assertEqual(True,
+                         '"--log-dir[log dir]::LOG_DIR:_directories"' in zsh)
+        self.assertEqual(True, '"--conf[config]::CONF:_files"' in zsh)
+
+    @available_argparse
+    def test_argparse_type(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--timeout", type=float, metavar="T")
+        parser.add_argument("--out", type=argparse.FileType('w'))
+        zsh = self._get_zsh(parser)
+        self.assertEqual(True, '"--timeout::T: "' in zsh)
+        self.assertEqual(True, '"--out::OUT:_files"' in zsh)
+
+    def test_user_mapping(self):
+        parser = OptionParser()
+        parser.add_option("--conf", metavar="CONF", help="config")
+        parser.add_option("--name", metavar="NAME", help="name")
+        zsh = self._get_zsh(parser, {'--conf': 'dir', 'NAME': '_users'})
+        self.assertEqual(True, '"--conf[config]::CONF:_directories"' in zsh)
+        self.assertEqual(True, '"--name[name]::NAME:_users"' in zsh)
+
+    @available_argparse
+    def test_user_mapping_over_choices(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--mode", choices=['a', 'b'], help="mode")
+        parser.add_argument("--level", choices=['1', '2'], metavar="LEVEL")
+        completers = {'--mode': '_modes', 'LEVEL': 'none'}
+        zsh = self._get_zsh(parser, completers)
+        self.assertEqual(True, '"--mode[mode]::MODE:_modes"' in zsh)
+        self.assertEqual(True, '"--level::LEVEL: "' in zsh)
+        bash = genzshcomp.CompletionGenerator(
+            'dummy', parser, output_format='bash',
+            completers=completers).get()
+        self.assertEqual(False, 'compgen -W "a b"' in bash)
+        self.assertEqual(False, 'compgen -W "1 2"' in bash)
+
+
+class TestCorpus(TestCase):
+
+    def test_no_regression(self):
+        import corpus_runner
+        import json
+        with open(corpus_runner.BASELINE_FILE) as fobj:
+            baseline = json.load(fobj)
+        for name, ok in sorted(baseline['cases'].items()):
+            if ok:
+                backend, result, message = corpus_runner.check_case(name)
+                self.assertEqual(True, result, "%s: %s" % (name, message))
+
+
+class TestGenerateBulk(TestCase):
+
+    def _get_generators(self, output_format='zsh'):
+        ret = []
+        for name in ('foo', 'bar', 'baz'):
+            parser = OptionParser()
+            parser.add_option("-q", action="store_true", help="quiet")
+            if name == 'baz':
+                parser.add_option("-v", action="store_true", help="verbose")
+            ret.append(genzshcomp.CompletionGenerator(
+                name, parser, output_format=output_format))
+        return ret
+
+    def test_no_dedup(self):
+        files = genzshcomp.generate_bulk(self._get_generators())
+        self.assertEqual(['_bar', '_baz', '_foo'], sorted(files))
+        self.assertEqual(True, files['_foo'].startswith("#compdef foo\n"))
+
+    def test_dedup(self):
+        files = genzshcomp.generate_bulk(self._get_generators(), dedup=True)
+        self.assertEqual(2, len(files))
+        self.assertEqual(True, files['_baz'].startswith("#compdef baz\n"))
+        shared = [i for i in files if i != '_baz'][0]
+        self.assertEqual(True, shared.startswith('_genzshcomp_'))
+        self.assertEqual(True,
+                         files[shared].startswith("#compdef foo bar\n"))
+
+    def test_bundle(self):
+        files = genzshcomp.generate_bulk(self._get_generators(), dedup=True)
+        bundle = genzshcomp.generate_bundle(files)
+        shared = [i for i in files if i != '_baz'][0]
+        self.assertEqual(True, "\n_baz() {\n  typeset -A opt_args\n" in bundle)
+        self.assertEqual(True, "\ncompdef _baz baz\n" in bundle)
+        self.assertEqual(True,
+                         "\ncompdef %s foo bar\n" % shared in bundle)
+        self.assertEqual(False, "#compdef" in bundle)
+
+    def test_lazy(self):
+        files = genzshcomp.generate_bulk(self._get_generators())
+        stubs, specs = genzshcomp.generate_lazy(files, '_dir')
+        self.assertEqual(['_bar', '_baz', '_foo'], sorted(stubs))
+        self.assertEqual(['bar.zspec', 'baz.zspec', 'foo.zspec'],
+                         sorted(specs))
+        self.assertEqual(True, stubs['_foo'].startswith("#compdef foo\n"))
+        self.assertEqual(True, 'source "${_dir}/foo.zspec"' in stubs['_foo'])
+        self.assertEqual(False, '-q[quiet]' in stubs['_foo'])
+        self.assertEqual(True, '\n  "-q[quiet]"\n' in specs['foo.zspec'])
+        bundle = genzshcomp.generate_bundle(stubs, '_dir')
+        self.assertEqual(True, "\ntypeset -g _dir=${${(%):-%x}:A:h}\n"
+                         in bundle)
+        self.assertEqual(True, "\ncompdef _foo foo\n" in bundle)
+        self.assertEqual(False, '-q[quiet]' in bundle)
+
+    def test_dedup_bash(self):
+        files = genzshcomp.generate_bulk(self._get_generators('bash'),
+                                         dedup=True)
+        self.assertEqual(['bar', 'baz', 'foo'], sorted(files))
+
+
+class TestBashCompletionDir(TestCase):
+
+    def setUp(self):
+        self.environ = os.environ.copy()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def test_user_dir(self):
+        os.environ['BASH_COMPLETION_USER_DIR'] = '/bc'
+        self.assertEqual('/bc/completions',
+                         genzshcomp.get_bash_completion_dir())
+
+    def test_user_dirs(self):
+        os.environ['BASH_COMPLETION_USER_DIR'] = ':/bc:/other'
+        self.assertEqual('/bc/completions',
+                         genzshcomp.get_bash_completion_dir())
+
+    def test_xdg_data_home(self):
+        os.environ.pop('BASH_COMPLETION_USER_DIR', None)
+        os.environ['XDG_DATA_HOME'] = '/data'
+        self.assertEqual('/data/bash-completion/completions',
+                         genzshcomp.get_bash_completion_dir())
+
+
+class TestGenBash(TestCase):
+
+    def test_prev_table(self):
+        parser = OptionParser()
+        parser.add_option("-f", "--file", metavar="FILE", help="a file")
+        parser.add_option("-o", "--out", metavar="FILE", help="output")
+        parser.add_option("--dir", metavar="DIR", help="a directory")
+        parser.add_option("--mode", type="choice", choices=["a", "b"])
+        parser.add_option("-n", metavar="N", help="count")
+        parser.add_option("-q", action="store_true", help="quiet")
+        bash = genzshcomp.CompletionGenerator('dummy', parser,
+                                              output_format='bash').get()
+        self.assertEqual(True, '    "--file"|"-f"|"--out"|"-o")\n'
+                               '      COMPREPLY=( $( compgen -f -- $cur ) )\n'
+                               in bash)
+        self.assertEqual(True, '    "--dir")\n'
+                               '      COMPREPLY=( $( compgen -d -- $cur ) )\n'
+                               in bash)
+        self.assertEqual(True, '      COMPREPLY=( $( compgen -W "a b" -- '
+                               '$cur ) )\n' in bash)
+        self.assertEqual(True, '    "-n")\n'
+                               '      compopt +o default' in bash)
+        self.assertEqual(False, '"-q")' in bash)
+
+
+class TestGenZshLarge(TestCase):
+
+    def _get_output(self):
+        parser = OptionParser()
+        parser.add_option("-f", "--file", metavar="FILE", help="a file")
+        parser.add_option("--fast", action="store_true", help="fast")
+        parser.add_option("-q", "--quiet", action="store_true")
+        return genzshcomp.CompletionGenerator(
+            'dummy', parser, output_format='zsh_large').get()
+
+    def test_groups(self):
+        output = self._get_output()
+        self.assertEqual(True, "_genzshcomp_large_dummy_opts=(\n"
+                               "  '--fast:fast'\n"
+                               "  '--help:show this help message and exit'\n"
+                               "  '--quiet'\n"
+                               "  '-f:a file'\n" in output)
+        self.assertEqual(True, "_genzshcomp_large_dummy_eqopts=(\n"
+                               "  '--file:a file'\n)" in output)
+        self.assertEqual(True, "    ('--f') opts=(\"${(@)_genzshcomp_large_"
+                               "dummy_opts[1,1]}\") eqopts=(\"${(@)_genzsh"
+                               "comp_large_dummy_eqopts[1,1]}\") ;;\n"
+                               in output)
+        self.assertEqual(True, "    ('-q') opts=(\"${(@)_genzshcomp_large_"
+                               "dummy_opts[6,6]}\") ;;\n" in output)
+
+    def test_value_specs(self):
+        output = self._get_output()
+        self.assertEqual(True, "_genzshcomp_large_dummy_specs=(\n"
+                               "  \"--file=[a file]:FILE:_files\"\n"
+                               "  \"-f[a file]::FILE:_files\"\n"
+                               "  \"*:args:_files\"\n)" in output)
+        self.assertEqual(True, "_genzshcomp_large_dummy_takes_value="
+                               "('--file' 1 '-f' 1)" in output)
+
+    def test_no_commandname(self):
+        hp = genzshcomp.HelpParser(
+            "options:\n  -h, --help  show this help message and exit\n")
+        output = genzshcomp.CompletionGenerator(
+            hp.get_commandname(), hp.help2parseobj(),
+            output_format='zsh_large').get()
+        self.assertEqual(True, "_genzshcomp_large_None_opts=(" in output)
+
+    def test_autoload(self):
+        lines = self._get_output().splitlines()
+        self.assertEqual("#compdef dummy", lines[0])
+        self.assertEqual(True, "_dummy() {" in lines)
+        self.assertEqual('_dummy "$@"', lines[-1])
+
+
+class ZshTestCase(TestCase):
+
+    """completion in interactive zsh with test/zsh_complete.zsh, skipped
+    when zsh is not installed."""
+
+    def setUp(self):
+        import tempfile
+        if genzshcomp._which('zsh') is None:
+            self.skipTest("zsh is not found")
+        self.tmpdir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.tmpdir, 'fpath')
+        os.mkdir(self.fpath)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def complete(self, lines, setup=':', env=None):
+        """return to list of matches of each line."""
+        import subprocess
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'zsh_complete.zsh')
+        output = subprocess.check_output(
+            ['zsh', '-f', script, self.fpath, setup] + lines,
+            cwd=self.tmpdir, env=env)
+        matches = output.decode('utf-8').split("--\n")[:-1]
+        return [i.splitlines() for i in matches]
+
+
+class TestZshLargeCompletion(ZshTestCase):
+
+    def test_complete(self):
+        with open(os.path.join(self.fpath, '_dummy'), 'w') as fobj:
+            fobj.write(TestGenZshLarge()._get_output())
+        with open(os.path.join(self.tmpdir, 'input.txt'), 'w') as fobj:
+            fobj.write("")
+        options, value, separated = self.complete(
+            ['dummy --f', 'dummy --file=inp', 'dummy --file inp'])
+        self.assertEqual(True, '--file' in options)
+        self.assertEqual(True, '--fast' in options)
+        self.assertEqual(['input.txt'], value)
+        self.assertEqual(['input.txt'], separated)
+
+
+class TestLazyBundleCompletion(ZshTestCase):
+
+    def test_moved(self):
+        parser = OptionParser()
+        parser.add_option("--verbose", action="store_true", help="verbose")
+        options = {'output_format': 'zsh', 'bundle': 'comp.zsh',
+                   'lazy': True}
+        genzshcomp.write_bulk([genzshcomp.CompletionGenerator('lazytool',
+                                                              parser)],
+                              os.path.join(self.tmpdir, 'out'), options)
+        os.rename(os.path.join(self.tmpdir, 'out'),
+                  os.path.join(self.tmpdir, 'moved'))
+        verbose, = self.complete(['lazytool --v'], "source moved/comp.zsh")
+        self.assertEqual(['--verbose'], verbose)
+
+
+class TestPycuiCompletion(ZshTestCase):
+
+    script = """#!%s
+from optparse import OptionParser
+parser = OptionParser()
+parser.add_option("--one", action="store_true", help="first option")
+parser.parse_args()
+"""
+
+    def setUp(self):
+        import shutil
+        ZshTestCase.setUp(self)
+        root = os.path.split(os.path.dirname(os.path.abspath(__file__)))[0]
+        shutil.copy(os.path.join(root, 'zshfunc', '_pycui'), self.fpath)
+        bindir = os.path.join(self.tmpdir, 'bin')
+        os.mkdir(bindir)
+        scripts = {'mytool': self.script % sys.executable,
+                   'notool': "#!/bin/sh\n",
+                   'genzshcomp': '#!/bin/sh\nexec %s %s "$@"\n' % (
+                       sys.executable, os.path.join(root, 'genzshcomp.py'))}
+        for name, content in scripts.items():
+            with open(os.path.join(bindir, name), 'w') as fobj:
+                fobj.write(content)
+            os.chmod(os.path.join(bindir, name), 0o755)
+        self.log = os.path.join(self.tmpdir, 'latency.log')
+        self.env = dict(os.environ, GENZSHCOMP_TELEMETRY_LOG=self.log,
+                        PATH=bindir + os.pathsep + os.environ['PATH'])
+        self.setup = (
+            "zmodload zsh/datetime; "
+            "zstyle ':completion:*' genzshcomp-telemetry yes; "
+            "zstyle ':completion:*' use-cache yes; "
+            "zstyle ':completion:*' cache-path %s; "
+            "compdef _pycui mytool notool" % os.path.join(self.tmpdir,
+                                                           'cache'))
+
+    def _get_phases(self):
+        with open(self.log) as fobj:
+            return [i.split()[3] for i in fobj]
+
+    def test_memo(self):
+        first, memo, _, updated = self.complete(
+            ['mytool -', 'mytool -',
+             '!sed -i s/one/two/ $commands[mytool]; '
+             'touch -d @$(( EPOCHSECONDS + 60 )) $commands[mytool]',
+             'mytool -'], self.setup, self.env)
+        self.assertEqual(True, '--one' in first)
+        self.assertEqual(first, memo)
+        self.assertEqual(True, '--two' in updated)
+        self.assertEqual(False, '--one' in updated)
+        self.assertEqual(['regenerate', 'memo', 'regenerate'],
+                         self._get_phases())
+
+    def test_store(self):
+        db = os.path.join(self.tmpdir, 'completion.db')
+        store = genzshcomp.CompletionStore(db)
+        parser = OptionParser()
+        parser.add_option("--stored", help="stored option")
+        store.update(genzshcomp.CompletionGenerator('mytool', parser))
+        store.close()
+        setup = self.setup + "; zstyle ':completion:*' genzshcomp-db " + db
+        stored, memo = self.complete(['mytool --', 'mytool --'], setup,
+                                     self.env)
+        self.assertEqual(True, '--stored' in stored)
+        self.assertEqual(stored, memo)
+        self.assertEqual(['store', 'memo'], self._get_phases())
+
+    def test_no_options(self):
+        first, second = self.complete(['notool -', 'notool -'], self.setup,
+                                      self.env)
+        self.assertEqual([], first)
+        self.assertEqual([], second)
+        self.assertEqual(['regenerate', 'cache'], self._get_phases())
+
+
+class TestTelemetry(TestCase):
+
+    def _get_output(self, output_format):
+        parser = OptionParser()
+        parser.add_option("-f", "--file", metavar="FILE", help="a file")
+        return genzshcomp.CompletionGenerator(
+            'dummy', parser, output_format=output_format,
+            telemetry=True).get()
+
+    def test_zsh(self):
+        for output_format in ('zsh', 'zsh_large'):
+            output = self._get_output(output_format)
+            self.assertEqual(True, "{\n" in output)
+            self.assertEqual(True, "} always {\n" in output)
+            self.assertEqual(True, '"$EPOCHSECONDS zsh $service '
+                                   '$_genzshcomp_phase $_genzshcomp_us"'
+                                   in output)
+        self.assertEqual(False, "always" in genzshcomp.CompletionGenerator(
+            'dummy', OptionParser()).get())
+
+    def test_bash(self):
+        output = self._get_output('bash')
+        self.assertEqual(True, "\n_dummy_timed()\n{\n" in output)
+        self.assertEqual(True, output.endswith(
+            "complete -F _dummy_timed -o default dummy"))
+
+    def test_stats(self):
+        import io
+        log = io.StringIO(u"1 zsh foo option 1000\n"
+                          u"1 zsh foo option 3000\n"
+                          u"broken line\n"
+                          u"2 zsh foo value 100\n"
+                          u"2 bash bar option 5000\n")
+        stats = genzshcomp.get_latency_stats(genzshcomp.read_telemetry(log))
+        self.assertEqual([('bar', 'bash', 'option', 1, 5000),
+                          ('foo', 'zsh', 'option', 2, 3000),
+                          ('foo', 'zsh', 'value', 1, 100)],
+                         [(i['command'], i['shell'], i['phase'], i['count'],
+                           i['p90']) for i in stats])
+        self.assertEqual(1000, stats[1]['p50'])
+
+
+class TestWatch(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _write_bulk(self, options, commands, prune=False, parsers=None):
+        parsers = parsers or {}
+        generators = [genzshcomp.CompletionGenerator(
+            name, parsers.get(name, OptionParser()),
+            output_format=options['output_format']) for name in commands]
+        report = genzshcomp.write_bulk(generators, self.tmpdir, options,
+                                       prune=prune)
+        genzshcomp.write_manifest(self.tmpdir, options, commands,
+                                  report['files'], prune=prune)
+        return report
+
+    def _get_compdefs(self):
+        ret = []
+        for filename in sorted(os.listdir(self.tmpdir)):
+            with open(os.path.join(self.tmpdir, filename)) as fobj:
+                line = fobj.readline().rstrip("\n")
+            if line.startswith('#compdef '):
+                ret.append(line)
+        return sorted(ret)
+
+    def test_dedup_rerun(self):
+        options = {'output_format': 'zsh', 'dedup': True, 'bundle': None,
+                   'lazy': False, 'telemetry': False, 'zcompile': False,
+                   'cache_dir': None, 'completers': {}}
+        self._write_bulk(options, ['t1', 't2', 't3'])
+        self.assertEqual(['#compdef t1 t2 t3'], self._get_compdefs())
+        # option of t1 and t2 is changed
+        parser = OptionParser()
+        parser.add_option("-q", action="store_true", help="quiet")
+        report = self._write_bulk(options, ['t1', 't2', 't3'], parsers={
+            't1': parser, 't2': parser})
+        self.assertEqual(1, len(report['removed']))
+        self.assertEqual(['#compdef t1 t2', '#compdef t3'],
+                         self._get_compdefs())
+        # only t1 is regenerated, shared file keeps t2
+        parser = OptionParser()
+        parser.add_option("-v", action="store_true", help="verbose")
+        self._write_bulk(options, ['t1'], parsers={'t1': parser})
+        self.assertEqual(['#compdef t1', '#compdef t2', '#compdef t3'],
+                         self._get_compdefs())
+        files = genzshcomp.read_manifest(self.tmpdir)['files']
+        self.assertEqual([['t1'], ['t2'], ['t3']],
+                         sorted(files.values()))
+
+    def test_manifest(self):
+        self.assertEqual(None, genzshcomp.read_manifest(self.tmpdir))
+        options = {'output_format': 'zsh', 'dedup': True, 'bundle': None,
+                   'lazy': False, 'telemetry': True, 'zcompile': False,
+                   'cache_dir': None, 'completers': {'FILE': 'file'}}
+        self._write_bulk(options, ['foo', 'bar'])
+        self._write_bulk(options, ['bar', 'baz'])
+        manifest = genzshcomp.read_manifest(self.tmpdir)
+        self.assertEqual(options, manifest['options'])
+        self.assertEqual(['foo', 'bar', 'baz'], manifest['commands'])
+        # manifest is not removed by prune
+        self._write_bulk(options, ['baz'], prune=True)
+        self.assertEqual(['baz'],
+                         genzshcomp.read_manifest(self.tmpdir)['commands'])
+        # other options replace commands
+        options = dict(options, bundle='_bundle', dedup=False)
+        self._write_bulk(options, ['foo'])
+        self.assertEqual(['foo'],
+                         genzshcomp.read_manifest(self.tmpdir)['commands'])
+        self.assertEqual(True, os.path.exists(
+            os.path.join(self.tmpdir, '_bundle')))
+
+    def test_lazy_bundle(self):
+        options = {'output_format': 'zsh', 'dedup': False,
+                   'bundle': 'comp.zsh', 'lazy': True, 'telemetry': False,
+                   'zcompile': False, 'cache_dir': None, 'completers': {}}
+        self._write_bulk(options, ['foo', 'bar'])
+        self.assertEqual(['.genzshcomp.json', 'bar.zspec', 'comp.zsh',
+                          'foo.zspec'], sorted(os.listdir(self.tmpdir)))
+        with open(os.path.join(self.tmpdir, 'comp.zsh')) as fobj:
+            bundle = fobj.read()
+        # spec directory is not written in bundle, so it can be moved
+        self.assertEqual(False, self.tmpdir in bundle)
+        self.assertEqual(True, '"${_genzshcomp_dir_comp_zsh}/foo.zspec"'
+                         in bundle)
+        files = genzshcomp.read_manifest(self.tmpdir)['files']
+        self.assertEqual(['bar'], files['bar.zspec'])
+        self.assertEqual(['foo', 'bar'], files['comp.zsh'])
+        # specs are removed with lazy option off
+        self._write_bulk(dict(options, lazy=False), ['foo', 'bar'])
+        self.assertEqual(['.genzshcomp.json', 'comp.zsh'],
+                         sorted(os.listdir(self.tmpdir)))
+
+    def test_watch_targets(self):
+        script = os.path.join(self.tmpdir, 'tool.py')
+        with open(script, 'w') as fobj:
+            fobj.write("#!/bin/sh\n")
+        os.chmod(script, 0o755)
+        command = "%s %s" % (sys.executable, script)
+        targets = genzshcomp._get_watch_targets(
+            [command, script, 'genzshcomp-no-such-command'])
+        self.assertEqual([command, script], targets[(self.tmpdir, 'tool.py')])
+        self.assertEqual([command], targets[os.path.split(
+            os.path.abspath(sys.executable))])
+        self.assertEqual(['genzshcomp-no-such-command'],
+                         targets[(None, 'genzshcomp-no-such-command')])
+
+    def test_inotify(self):
+        if not sys.platform.startswith('linux'):
+            return
+        watcher = genzshcomp.InotifyWatcher()
+        try:
+            self.assertEqual(True, watcher.add_watch(self.tmpdir) >= 0)
+            self.assertEqual([], watcher.read_events(0))
+            with open(os.path.join(self.tmpdir, 'cmd'), 'w') as fobj:
+                fobj.write("#!/bin/sh\n")
+            events = watcher.read_events(1)
+            self.assertEqual(True, (self.tmpdir, 'cmd') in events)
+        finally:
+            watcher.close()
+
+
+class TestJson(TestCase):
+
+    def _get_parser(self):
+        parser = OptionParser()
+        parser.add_option("-f", "--file", metavar="FILE", help="a file")
+        parser.add_option("--mode", type="choice", choices=["a", "b"])
+        parser.add_option("-q", action="store_true", help="quiet")
+        return parser
+
+    def test_export(self):
+        import json
+        gen = genzshcomp.CompletionGenerator('dummy', self._get_parser(),
+                                             output_format='json')
+        data = json.loads(gen.get())
+        self.assertEqual(1, data['version'])
+        self.assertEqual('dummy', data['command'])
+        self.assertEqual('optparse', data['parser_type'])
+        entry = data['options'][1]
+        self.assertEqual(['-f'], entry['short'])
+        self.assertEqual(['--file'], entry['long'])
+        self.assertEqual('FILE', entry['metavar'])
+        self.assertEqual(True, entry['takes_value'])
+        self.assertEqual(['a', 'b'], data['options'][2]['choices'])
+        self.assertEqual(False, data['options'][3]['takes_value'])
+
+    def test_roundtrip(self):
+        for output_format in ('zsh', 'bash', 'list'):
+            gen = genzshcomp.CompletionGenerator(
+                'dummy', self._get_parser(), output_format='json')
+            loaded = genzshcomp.load_json(gen.get(),
+                                          output_format=output_format)
+            gen.output_format = output_format
+            self.assertEqual(gen.get(), loaded.get())
+
+    def test_minimal_entry(self):
+        gen = genzshcomp.load_json({'version': 1, 'command': 'dummy',
+                                    'options': [{'options': ['-x']}]})
+        self.assertEqual(True, '"-x" \\' in gen.get())
+
+    def test_invalid_version(self):
+        self.assertRaises(ValueError, genzshcomp.load_json,
+                          '{"version": 2, "options": []}')
+
+
+class TestWriteCompletions(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _get_files(self, *names):
+        generators = [genzshcomp.CompletionGenerator(i, OptionParser())
+                      for i in names]
+        return genzshcomp.generate_bulk(generators)
+
+    def test_report(self):
+        report = genzshcomp.write_completions(self._get_files('foo', 'bar'),
+                                              self.tmpdir)
+        self.assertEqual(['_bar', '_foo'], report['added'])
+        path = os.path.join(self.tmpdir, '_foo')
+        os.utime(path, (0, 0))
+        files = self._get_files('foo', 'bar')
+        files['_bar'] += "\n"
+        report = genzshcomp.write_completions(files, self.tmpdir)
+        self.assertEqual([], report['added'])
+        self.assertEqual(['_bar'], report['changed'])
+        self.assertEqual(['_foo'], report['unchanged'])
+        self.assertEqual(0, os.stat(path).st_mtime)
+
+    def test_prune(self):
+        genzshcomp.write_completions(self._get_files('foo', 'bar'),
+                                     self.tmpdir)
+        other = os.path.join(self.tmpdir, '_other')
+        with open(other, 'w') as fobj:
+            fobj.write("#compdef other\n")
+        report = genzshcomp.write_completions(self._get_files('foo'),
+                                              self.tmpdir, prune=True)
+        self.assertEqual(['_bar'], report['removed'])
+        self.assertEqual(True, os.path.exists(other))
+        self.assertEqual(False,
+                         os.path.exists(os.path.join(self.tmpdir, '_bar')))
+
+
+class TestResourceReport(TestCase):
+
+    script = """#!%s
+from optparse import OptionParser
+parser = OptionParser()
+parser.add_option("-f", "--file", metavar="FILE", help="input file")
+parser.parse_args()
+"""
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.command = os.path.join(self.tmpdir, 'tool')
+        self._write_script()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _write_script(self, extra=""):
+        with open(self.command, 'w') as fobj:
+            fobj.write(self.script % sys.executable + extra)
+        os.chmod(self.command, 0o755)
+
+    def _run(self):
+        stats = []
+        generators, status = genzshcomp._get_generators(
+            [self.command], 'zsh', None, stats,
+            os.path.join(self.tmpdir, 'cache'))
+        self.assertEqual(0, status)
+        genzshcomp.generate_bulk(generators, stats=dict(
+            (i['name'], i) for i in stats))
+        return stats[0]
+
+    def test_cache(self):
+        stat = self._run()
+        self.assertEqual('miss', stat['cache'])
+        self.assertEqual(True, stat['capture_time'] > 0)
+        self.assertEqual(True, 'maxrss' in stat)
+        self.assertEqual(2, stat['options'])
+        size = stat['size']
+        self.assertEqual(True, size > 0)
+        stat = self._run()
+        self.assertEqual('hit', stat['cache'])
+        self.assertEqual(None, stat['capture_time'])
+        self.assertEqual(2, stat['options'])
+        self.assertEqual(size, stat['size'])
+        # executable is changed
+        self._write_script("# updated\n")
+        self.assertEqual('miss', self._run()['cache'])
+
+    def test_interpreter(self):
+        generators, status = genzshcomp._get_generators(
+            ["%s %s" % (sys.executable, self.command)], 'zsh', None)
+        self.assertEqual(0, status)
+        self.assertEqual('tool', generators[0].commandname)
+
+    def test_interpreter_cache_key(self):
+        command = "%s %s" % (sys.executable, self.command)
+        key = genzshcomp.get_help_cache_key(command)
+        self.assertEqual(True, os.path.abspath(self.command) in key)
+        # script is changed
+        self._write_script("# updated\n" * 10)
+        self.assertNotEqual(key, genzshcomp.get_help_cache_key(command))
+        self.assertEqual(None, genzshcomp.get_help_cache_key(
+            "%s -m tool" % sys.executable))
+
+    def test_runner_only_with_stats(self):
+        calls = []
+        saved = genzshcomp.get_help_text
+
+        def get_help_text(command, stats=None):
+            calls.append(stats)
+            return saved(command, stats)
+        genzshcomp.get_help_text = get_help_text
+        try:
+            genzshcomp._get_generators([self.command], 'zsh', None)
+            self.assertEqual([None], calls)
+            stat = self._run()
+            self.assertEqual(True, calls[-1] is not None)
+            if hasattr(os, 'wait4'):
+                self.assertEqual(True, stat['runner_time'] > 0)
+        finally:
+            genzshcomp.get_help_text = saved
+
+    def test_maxrss_floor(self):
+        if not hasattr(os, 'wait4'):
+            return
+        stat = self._run()
+        self.assertEqual(True, stat['maxrss_floor'] > 0)
+        if stat['maxrss'] is not None:
+            self.assertEqual(True, stat['maxrss'] > stat['maxrss_floor'])
+
+    def test_report(self):
+        stats = []
+        for cnt in range(1, 11):
+            stats.append({'command': 'cmd%d' % cnt, 'name': 'cmd%d' % cnt,
+                          'error': None, 'cache': 'miss',
+                          'capture_time': cnt / 10.0, 'parse_time': 0.01,
+                          'render_time': 0.01, 'size': cnt * 100,
+                          'options': cnt, 'maxrss': None})
+        stats[0]['error'] = 'failed'
+        stats[1]['cache'] = 'hit'
+        report = genzshcomp.get_resource_report(stats, top=2)
+        summary = report['summary']
+        self.assertEqual(10, summary['commands'])
+        self.assertEqual(1, summary['errors'])
+        self.assertEqual(1, summary['cache_hits'])
+        self.assertEqual(9, summary['cache_misses'])
+        self.assertEqual(500, summary['size']['p50'])
+        self.assertEqual(900, summary['size']['p90'])
+        self.assertEqual(1000, summary['size']['p99'])
+        self.assertEqual(5500, summary['size']['total'])
+        self.assertEqual(None, summary['maxrss'])
+        self.assertEqual([['cmd10', 10], ['cmd9', 9]], report['top']['options'])
+
+
+class TestCompletionStore(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = genzshcomp.CompletionStore(
+            os.path.join(self.tmpdir, 'completion.db'))
+
+    def tearDown(self):
+        import shutil
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _get_generator(self, name='dummy'):
+        parser = OptionParser()
+        parser.add_option("-f", "--file", metavar="FILE", help="a file")
+        parser.add_option("--host", metavar="HOST", help="a host")
+        parser.add_option("-q", action="store_true", help="quiet")
+        return genzshcomp.CompletionGenerator(name, parser)
+
+    def test_query(self):
+        self.store.update(self._get_generator())
+        self.store.update(self._get_generator('other'))
+        ret = self.store.query('dummy')
+        self.assertEqual(('--help', 'show this help message and exit'),
+                         ret[0])
+        self.assertEqual(6, len(ret))
+        self.assertEqual([('--file', 'a file')],
+                         self.store.query('dummy', '--f'))
+        self.assertEqual(['--help', '--host'],
+                         [i[0] for i in self.store.query('dummy', '--h')])
+
+    def test_update(self):
+        self.store.update(self._get_generator())
+        self.store.update(self._get_generator())
+        self.assertEqual(6, len(self.store.query('dummy')))
+        kinds = dict(self.store.conn.execute(
+            "SELECT option, kind FROM options WHERE command = 'dummy'"))
+        self.assertEqual('file', kinds['--file'])
+        self.assertEqual('host', kinds['--host'])
+        self.assertEqual('flag', kinds['-q'])
+
+    def test_readonly(self):
+        import sqlite3
+        self.store.update(self._get_generator())
+        path = os.path.join(self.tmpdir, 'completion.db')
+        store = genzshcomp.CompletionStore(path, readonly=True)
+        try:
+            self.assertEqual(6, len(store.query('dummy')))
+            self.assertRaises(sqlite3.OperationalError, store.conn.execute,
+                              "DELETE FROM options")
+        finally:
+            store.close()
+
+    def test_readonly_not_found(self):
+        path = os.path.join(self.tmpdir, 'notfound.db')
+        self.assertRaises(IOError, genzshcomp.CompletionStore, path,
+                          readonly=True)
+        self.assertEqual(False, os.path.exists(path))
+
+
+class TestSubcommands(TestCase):
+
+    help_string = """\
+usage: sub [-h] {build,deploy,clean} ...
+
+positional arguments:
+  {build,deploy,clean}
+    build               build things
+    deploy              deploy it
+    clean
+
+options:
+  -h, --help            show this help message and exit
+"""
+
+    def test_get_subcommands(self):
+        hp = genzshcomp.HelpParser(self.help_string)
+        self.assertEqual([('build', 'build things'), ('deploy', 'deploy it'),
+                          ('clean', '')], hp.get_subcommands())
+
+    def test_no_subcommands(self):
+        hp = genzshcomp.HelpParser(self.help_string.replace(
+            "  {build,deploy,clean}\n", ""))
+        self.assertEqual([], hp.get_subcommands())
+
+    def test_discover_script(self):
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'tool.py')
+            with open(path, 'w') as fobj:
+                fobj.write("from argparse import ArgumentParser\n"
+                           "parser = ArgumentParser()\n"
+                           "parser.add_argument('--verbose', "
+                           "action='store_true', help='verbose')\n"
+                           "sub = parser.add_subparsers()\n"
+                           "sub.add_parser('build', help='build things')\n"
+                           "parser.parse_args()\n")
+            tree = genzshcomp.discover_subcommands(
+                "%s %s" % (sys.executable, path), jobs=2)
+        finally:
+            shutil.rmtree(tmpdir)
+        # not the interpreter
+        self.assertEqual('tool.py', tree['name'])
+        self.assertEqual(['build'], [i['name'] for i in tree['subcommands']])
+
+    def _node(self, name, options, subcommands=()):
+        table = [{'options': [i], 'metavar': None, 'choices': None,
+                  'help': None, 'action': 'store_true',
+                  'takes_value': False, 'type': None} for i in options]
+        return {'name': name, 'command': name, 'description': name.upper(),
+                'parser_type': 'argparse', 'options': table,
+                'subcommands': list(subcommands)}
+
+    def test_generate_zsh_tree(self):
+        tree = self._node('sub', ['-v'], [
+            self._node('build', ['-j']), self._node('deploy', ['-x']),
+            self._node('clean', ['-j'])])
+        zsh = genzshcomp.generate_zsh_tree(tree)
+        self.assertEqual(True, zsh.startswith("#compdef sub\n"))
+        self.assertEqual(True, "\n_sub() {\n" in zsh)
+        self.assertEqual(True, '"build:BUILD"' in zsh)
+        self.assertEqual(True, "      build) _sub_build ;;\n" in zsh)
+        # same options, shared function
+        self.assertEqual(True, "      clean) _sub_build ;;\n" in zsh)
+        self.assertEqual(False, "_sub_clean" in zsh)
+        self.assertEqual(True, zsh.endswith('_sub "$@"'))
+
+    @available_argparse
+    def test_discover(self):
+        import tempfile
+        script = tempfile.NamedTemporaryFile('w', suffix='.py',
+                                             delete=False)
+        script.write("""\
+import argparse
+parser = argparse.ArgumentParser(prog='sub')
+subparsers = parser.add_subparsers()
+build = subparsers.add_parser('build', help='build things')
+build.add_argument('--jobs', metavar='N', help='number of jobs')
+build.add_subparsers().add_parser('all')
+subparsers.add_parser('clean')
+parser.parse_args()
+""")
+        script.close()
+        try:
+            tree = genzshcomp.discover_subcommands(
+                '"%s" "%s"' % (sys.executable, script.name), max_depth=1)
+        finally:
+            os.remove(script.name)
+        self.assertEqual(['build', 'clean'],
+                         [i['name'] for i in tree['subcommands']])
+        build = tree['subcommands'][0]
+        self.assertEqual('build things', build['description'])
+        self.assertEqual(['--jobs'], build['options'][-1]['options'])
+        # max_depth
+        self.assertEqual([], build['subcommands'])
+
+
 if __name__ == '__main__':
     main()